@@ -1,16 +1,26 @@
 import os
 import re
+import json
 import asyncio
-from dataclasses import dataclass
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass, field
 from datetime import datetime
+from time import perf_counter
 from typing import Any
 from zoneinfo import ZoneInfo
 
 import aiohttp
-from web_scraper import analyze_urls_in_text, search_web
-
-AI_CHAT_URL = "https://openrouter.ai/api/v1/chat/completions"
+from classifier import get_classifier
+from http_pool import get_session
+from metrics import STAGE_DURATION, UPSTREAM_RETRIES
+from passages import select_passages
+from scheduler import PRIORITY_CHAT, PRIORITY_TITLE, CircuitOpenError, backoff_delay, get_scheduler, parse_retry_after
+from tracing import annotate, span
+from web_scraper import URL_ANALYSIS_DEADLINE_SECONDS, analyze_urls_in_text, search_web
+
+AI_CHAT_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions").strip()
 DEFAULT_MODEL = "openrouter/free"
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
 DEFAULT_SYSTEM_PROMPT = (
     "You are bearCode, a careful, concise, and helpful AI assistant for software, product thinking, and general problem solving. "
     "Reply in the same language the user uses unless they ask otherwise. "
@@ -30,6 +40,19 @@ TITLE_SYSTEM_PROMPT = (
     "Do not use quotes, punctuation at the end, provider names, or the word chat. "
     "Return only the title."
 )
+TITLE_BATCH_SYSTEM_PROMPT = (
+    "Create a short topic title for each numbered chat below using only the user's messages. "
+    "Use 2 to 5 words per title. "
+    "Capture the subject, not the assistant's wording. "
+    "Never start with phrases like sorry, apologies, okay, sure, I can, I cannot, or I should. "
+    "Do not use provider names or the word chat. "
+    "Return only a JSON array of strings with one title per chat, in the same order."
+)
+WEB_CONTEXT_INTRO = "Fresh web context is provided below. Use it when relevant, cite source URLs naturally, and say when the search results are limited."
+URL_CONTEXT_MARGIN_SECONDS = 0.5
+MESSAGE_TOKEN_OVERHEAD = 4
+MIN_TRUNCATED_TOKENS = 64
+TRUNCATION_MARKER = "\n[…]"
 REFUSAL_TEXT = (
     "I cannot help with bypassing safeguards, illegal activity, or instructions that could cause harm. "
     "I can still help with a safe, defensive, educational, or lawful version of the task."
@@ -37,63 +60,64 @@ REFUSAL_TEXT = (
 
 
 class AIProviderError(Exception):
-    pass
+    def __init__(self, message: str, reason: str = "provider"):
+        super().__init__(message)
+        self.reason = reason
 
 
 @dataclass(frozen=True)
 class AIConfig:
     api_key: str
     model: str
+    models: tuple[str, ...]
+    hedge_seconds: float
     site_url: str
     site_name: str
     timeout_seconds: float
     max_history_messages: int
     max_tokens: int
     timezone: str
+    web_context_budget_seconds: float
+    web_source_budget_seconds: float
+    prompt_token_budget: int
+    url_context_chars: int
+    max_attempts: int
+
+
+@dataclass
+class ResponseStats:
+    timings: dict[str, float] = field(default_factory=dict)
+    prompt_tokens: int | None = None
+    model: str | None = None
+
+
+ContextSource = tuple[str, Callable[[str], Awaitable[str]]]
 
 
 def get_ai_config() -> AIConfig:
+    model = os.getenv("OPENROUTER_MODEL", DEFAULT_MODEL).strip() or DEFAULT_MODEL
+    models = tuple(dict.fromkeys(item.strip() for item in os.getenv("OPENROUTER_MODELS", "").split(",") if item.strip())) or (model,)
     return AIConfig(
         api_key=os.getenv("OPENROUTER_API_KEY", "").strip(),
-        model=os.getenv("OPENROUTER_MODEL", DEFAULT_MODEL).strip() or DEFAULT_MODEL,
+        model=models[0],
+        models=models,
+        hedge_seconds=float(os.getenv("OPENROUTER_HEDGE_SECONDS", "8")),
         site_url=os.getenv("OPENROUTER_SITE_URL", "http://127.0.0.1:8080").strip(),
         site_name=os.getenv("OPENROUTER_SITE_NAME", "bearCode AI Assistant").strip(),
         timeout_seconds=float(os.getenv("OPENROUTER_TIMEOUT_SECONDS", "90")),
         max_history_messages=int(os.getenv("OPENROUTER_MAX_HISTORY_MESSAGES", "12")),
         max_tokens=int(os.getenv("OPENROUTER_MAX_TOKENS", "4096")),
         timezone=os.getenv("APP_TIMEZONE", "Asia/Dhaka").strip() or "Asia/Dhaka",
+        web_context_budget_seconds=float(os.getenv("WEB_CONTEXT_BUDGET_SECONDS", "10")),
+        web_source_budget_seconds=float(os.getenv("WEB_CONTEXT_SOURCE_SECONDS", "8")),
+        prompt_token_budget=int(os.getenv("OPENROUTER_PROMPT_TOKEN_BUDGET", "6000")),
+        url_context_chars=int(os.getenv("URL_CONTEXT_CHARS", "4000")),
+        max_attempts=max(int(os.getenv("OPENROUTER_MAX_RETRIES", "2")) + 1, 1),
     )
 
 
 def is_disallowed_request(text: str) -> bool:
-    normalized = re.sub(r"\s+", " ", text.lower()).strip()
-    jailbreak_patterns = [
-        r"ignore (all )?(previous|prior|system|developer) instructions",
-        r"disregard (all )?(previous|prior|system|developer) instructions",
-        r"reveal (your )?(system prompt|hidden prompt|developer instructions|instructions)",
-        r"show (your )?(system prompt|hidden prompt|developer instructions|instructions)",
-        r"developer mode",
-        r"dan mode",
-        r"jailbreak",
-        r"bypass (safety|guardrails|filters|restrictions|policy)",
-    ]
-    harmful_patterns = [
-        r"steal (password|credentials|token|cookie|session)",
-        r"phishing",
-        r"keylogger",
-        r"ransomware",
-        r"malware",
-        r"botnet",
-        r"carding",
-        r"exploit .* without permission",
-        r"hack .* account",
-        r"bypass .* login",
-        r"make .* bomb",
-        r"build .* explosive",
-        r"buy illegal",
-        r"sell illegal",
-    ]
-    return any(re.search(pattern, normalized) for pattern in jailbreak_patterns + harmful_patterns)
+    return get_classifier().is_disallowed(text)
 
 
 def current_date_text(timezone_name: str) -> str:
@@ -112,60 +136,190 @@ def build_system_prompt(config: AIConfig, web_context: str = "") -> str:
     ]
 
     if web_context:
-        parts.append(
-            "Fresh web context is provided below. Use it when relevant, cite source URLs naturally, and say when the search results are limited.\n\n"
-            f"{web_context}"
-        )
+        parts.append(f"{WEB_CONTEXT_INTRO}\n\n{web_context}")
 
     return "\n\n".join(parts)
 
 
-def build_messages(user_message: str, history: list[dict[str, str]], max_history_messages: int, config: AIConfig, web_context: str = "") -> list[dict[str, Any]]:
-    messages: list[dict[str, Any]] = [{"role": "system", "content": build_system_prompt(config, web_context)}]
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    ascii_chars = sum(1 for char in text if char < "\x80")
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars + 1) // 2
+
+
+def message_tokens(content: str) -> int:
+    return estimate_tokens(content) + MESSAGE_TOKEN_OVERHEAD
 
-    for item in history[-max_history_messages:]:
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) + estimate_tokens(TRUNCATION_MARKER) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + TRUNCATION_MARKER if low else ""
+
+
+def pack_history(history: list[dict[str, str]], max_history_messages: int, budget: int) -> tuple[list[dict[str, Any]], int]:
+    packed: list[dict[str, Any]] = []
+    used = 0
+    for item in reversed(history[-max_history_messages:] if max_history_messages > 0 else []):
         role = item.get("role")
         content = item.get("content")
-        if role in {"user", "assistant"} and isinstance(content, str) and content.strip():
-            messages.append({"role": role, "content": content.strip()})
+        if role not in {"user", "assistant"} or not isinstance(content, str) or not content.strip():
+            continue
+
+        content = content.strip()
+        remaining = budget - used
+        if message_tokens(content) > remaining:
+            if remaining - MESSAGE_TOKEN_OVERHEAD < MIN_TRUNCATED_TOKENS:
+                break
+            content = truncate_to_tokens(content, remaining - MESSAGE_TOKEN_OVERHEAD)
+            if not content:
+                break
+
+        packed.append({"role": role, "content": content})
+        used += message_tokens(content)
+
+    packed.reverse()
+    return packed, used
+
+
+def build_messages(
+    user_message: str,
+    history: list[dict[str, str]],
+    config: AIConfig,
+    web_context: str = "",
+    stats: ResponseStats | None = None,
+) -> list[dict[str, Any]]:
+    user_content = user_message.strip()
+    if web_context:
+        used = message_tokens(build_system_prompt(config)) + message_tokens(user_content)
+        context_budget = config.prompt_token_budget - used - estimate_tokens(WEB_CONTEXT_INTRO) - 1
+        web_context = truncate_to_tokens(web_context, context_budget) if context_budget >= MIN_TRUNCATED_TOKENS else ""
 
-    messages.append({"role": "user", "content": user_message.strip()})
-    return messages
+    system_prompt = build_system_prompt(config, web_context)
+    used = message_tokens(system_prompt) + message_tokens(user_content)
+    history_messages, history_tokens = pack_history(history, config.max_history_messages, config.prompt_token_budget - used)
 
+    if stats is not None:
+        stats.prompt_tokens = used + history_tokens
 
-async def generate_ai_response(user_message: str, history: list[dict[str, str]] | None = None) -> str:
+    return [
+        {"role": "system", "content": system_prompt},
+        *history_messages,
+        {"role": "user", "content": user_content},
+    ]
+
+
+async def generate_ai_response(
+    user_message: str,
+    history: list[dict[str, str]] | None = None,
+    stats: ResponseStats | None = None,
+    user_id: str = "",
+) -> str:
     if is_disallowed_request(user_message):
         return REFUSAL_TEXT
 
+    stats = stats or ResponseStats()
     config = get_ai_config()
-    web_context = await build_web_context(user_message)
-    messages = build_messages(user_message, history or [], config.max_history_messages, config, web_context)
-    return await request_completion(messages, temperature=0.55, max_tokens=config.max_tokens)
+    web_context = await build_web_context(user_message, stats)
+    messages = build_messages(user_message, history or [], config, web_context, stats)
+    started_at = perf_counter()
+    try:
+        with span("upstream.completion", prompt_tokens=stats.prompt_tokens):
+            return await hedged_completion(messages, temperature=0.55, max_tokens=config.max_tokens, config=config, stats=stats, user_id=user_id)
+    finally:
+        stats.timings["completion"] = round(perf_counter() - started_at, 3)
+        STAGE_DURATION.observe(stats.timings["completion"], stage="upstream")
+
+
+async def generate_ai_response_stream(
+    user_message: str,
+    history: list[dict[str, str]] | None = None,
+    stats: ResponseStats | None = None,
+    user_id: str = "",
+) -> AsyncIterator[str]:
+    if is_disallowed_request(user_message):
+        yield REFUSAL_TEXT
+        return
 
+    stats = stats or ResponseStats()
+    config = get_ai_config()
+    web_context = await build_web_context(user_message, stats)
+    messages = build_messages(user_message, history or [], config, web_context, stats)
+    started_at = perf_counter()
+    try:
+        async for delta in hedged_stream_completion(messages, temperature=0.55, max_tokens=config.max_tokens, config=config, stats=stats, user_id=user_id):
+            yield delta
+    finally:
+        stats.timings["completion"] = round(perf_counter() - started_at, 3)
+        STAGE_DURATION.observe(stats.timings["completion"], stage="upstream")
 
-async def build_web_context(user_message: str) -> str:
-    blocks = []
-    url_context = await build_url_context(user_message)
-    if url_context:
-        blocks.append(url_context)
 
+def web_context_sources(user_message: str) -> list[ContextSource]:
+    sources: list[ContextSource] = [("url", build_url_context)]
     if should_search_web(user_message):
-        search_context = await build_search_context(user_message)
-        if search_context:
-            blocks.append(search_context)
+        sources.append(("search", build_search_context))
+    return sources
+
+
+async def run_context_source(name: str, build: Callable[[str], Awaitable[str]], user_message: str, budget: float, timings: dict[str, float]) -> str:
+    started_at = perf_counter()
+    try:
+        with span(f"web_context.{name}", budget=budget):
+            return await asyncio.wait_for(build(user_message), timeout=budget)
+    except TimeoutError:
+        return ""
+    except Exception as exc:
+        print(f"Web context source {name} failed: {exc}")
+        return ""
+    finally:
+        timings[name] = round(perf_counter() - started_at, 3)
+
 
-    return "\n\n".join(blocks)
+async def build_web_context(user_message: str, stats: ResponseStats | None = None) -> str:
+    config = get_ai_config()
+    timings = stats.timings if stats else {}
+    started_at = perf_counter()
+    with span("web_context", budget=config.web_context_budget_seconds):
+        tasks = [
+            asyncio.create_task(run_context_source(name, build, user_message, config.web_source_budget_seconds, timings))
+            for name, build in web_context_sources(user_message)
+        ]
+
+        done, pending = await asyncio.wait(tasks, timeout=config.web_context_budget_seconds)
+        for task in pending:
+            task.cancel()
+        if pending:
+            annotate(timed_out=len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    timings["web_context"] = round(perf_counter() - started_at, 3)
+    STAGE_DURATION.observe(timings["web_context"], stage="web_context")
+    return "\n\n".join(task.result() for task in tasks if task in done and task.result())
 
 
 async def build_url_context(user_message: str) -> str:
-    url_analysis = await analyze_urls_in_text(user_message)
+    config = get_ai_config()
+    budget = min(config.web_source_budget_seconds, config.web_context_budget_seconds)
+    deadline = min(URL_ANALYSIS_DEADLINE_SECONDS, max(budget - URL_CONTEXT_MARGIN_SECONDS, budget / 2))
+    url_analysis = await analyze_urls_in_text(user_message, deadline=deadline)
     if not url_analysis.get("found"):
         return ""
 
+    query = get_classifier().strip("url", user_message)
     lines = ["User-provided page context:"]
     for result in url_analysis.get("results", []):
         if result.get("success"):
-            lines.append(f"Source: {result.get('url')}\n{str(result.get('content') or '')[:7000]}")
+            content = select_passages(str(result.get("content") or ""), query, config.url_context_chars)
+            lines.append(f"Source: {result.get('url')}\n{content}")
         else:
             lines.append(f"Source: {result.get('url')}\nCould not read this page: {result.get('error')}")
 
@@ -192,28 +346,28 @@ async def build_search_context(user_message: str) -> str:
 
 
 def should_search_web(user_message: str) -> bool:
-    normalized = user_message.lower()
-    patterns = [
-        r"\b(search|web|internet|online|look up|find information|latest|current|today|news)\b",
-        r"(поищи|найди|загугли|в интернете|в сети|актуальн|свеж|новост|сегодня|сейчас|текущ)",
-    ]
-    return any(re.search(pattern, normalized) for pattern in patterns)
+    return "search" in get_classifier().classify(user_message)
 
 
 def clean_search_query(user_message: str) -> str:
-    cleaned = re.sub(r"https?://\S+", "", user_message).strip()
-    cleaned = re.sub(r"^(поищи|найди|загугли)\s+(в интернете|информацию)?\s*", "", cleaned, flags=re.IGNORECASE)
+    classifier = get_classifier()
+    cleaned = classifier.strip("url", user_message).strip()
+    cleaned = classifier.strip("search_command", cleaned)
     return cleaned[:300] or user_message[:300]
 
 
-async def generate_chat_title(messages: list[dict[str, str]]) -> str:
+def title_messages(messages: list[dict[str, str]]) -> list[dict[str, str]]:
     compact_history = []
     for item in messages[-8:]:
         role = item.get("role")
         content = item.get("content")
         if role == "user" and content:
             compact_history.append({"role": role, "content": content[:500]})
+    return compact_history
 
+
+async def generate_chat_title(messages: list[dict[str, str]], user_id: str = "") -> str:
+    compact_history = title_messages(messages)
     if not compact_history:
         return "New chat"
 
@@ -221,22 +375,59 @@ async def generate_chat_title(messages: list[dict[str, str]]) -> str:
         [{"role": "system", "content": TITLE_SYSTEM_PROMPT}, *compact_history],
         temperature=0.25,
         max_tokens=18,
+        user_id=user_id,
+        priority=PRIORITY_TITLE,
     )
     return normalize_title(title)
 
 
-async def request_completion(messages: list[dict[str, Any]], temperature: float, max_tokens: int) -> str:
-    config = get_ai_config()
+async def generate_chat_titles(conversations: list[list[dict[str, str]]], user_id: str = "titles") -> list[str]:
+    if len(conversations) == 1:
+        return [await generate_chat_title(conversations[0], user_id)]
 
-    if not config.api_key:
-        raise AIProviderError("AI service is not configured")
+    blocks = []
+    for index, messages in enumerate(conversations, start=1):
+        turns = "\n".join(f"- {item['content']}" for item in title_messages(messages)) or "- (empty)"
+        blocks.append(f"Chat {index}:\n{turns}")
 
+    content = await request_completion(
+        [{"role": "system", "content": TITLE_BATCH_SYSTEM_PROMPT}, {"role": "user", "content": "\n\n".join(blocks)}],
+        temperature=0.25,
+        max_tokens=24 * len(conversations) + 16,
+        user_id=user_id,
+        priority=PRIORITY_TITLE,
+    )
+    titles = parse_title_batch(content)
+    return [normalize_title(title) if isinstance(title, str) and title.strip() else "" for title in titles[: len(conversations)]]
+
+
+def parse_title_batch(content: str) -> list[Any]:
+    start, end = content.find("["), content.rfind("]")
+    if start == -1 or end <= start:
+        return []
+    try:
+        titles = json.loads(content[start : end + 1])
+    except json.JSONDecodeError:
+        return []
+    return titles if isinstance(titles, list) else []
+
+
+def build_completion_request(
+    config: AIConfig,
+    messages: list[dict[str, Any]],
+    temperature: float,
+    max_tokens: int,
+    stream: bool = False,
+    model: str | None = None,
+) -> tuple[dict[str, Any], dict[str, str]]:
     payload = {
-        "model": config.model,
+        "model": model or config.model,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
+    if stream:
+        payload["stream"] = True
 
     headers = {
         "Authorization": f"Bearer {config.api_key}",
@@ -244,50 +435,276 @@ async def request_completion(messages: list[dict[str, Any]], temperature: float,
         "HTTP-Referer": config.site_url,
         "X-OpenRouter-Title": config.site_name,
     }
+    return payload, headers
+
+
+def upstream_failure(status: int) -> bool:
+    return status >= 500 or status == 408
 
+
+async def wait_before_retry(attempt: int, config: AIConfig, retry_after: float | None = None) -> bool:
+    scheduler = get_scheduler()
+    if attempt + 1 >= config.max_attempts:
+        return False
+
+    delay = backoff_delay(attempt, retry_after, scheduler.config)
+    if delay is None:
+        return False
+
+    scheduler.retries += 1
+    UPSTREAM_RETRIES.inc()
+    with span("upstream.backoff", attempt=attempt, delay=round(delay, 3)):
+        await asyncio.sleep(delay)
+    return True
+
+
+async def request_completion(
+    messages: list[dict[str, Any]],
+    temperature: float,
+    max_tokens: int,
+    user_id: str = "",
+    priority: int = PRIORITY_CHAT,
+    model: str | None = None,
+) -> str:
+    config = get_ai_config()
+
+    if not config.api_key:
+        raise AIProviderError("AI service is not configured", "not_configured")
+
+    payload, headers = build_completion_request(config, messages, temperature, max_tokens, model=model)
     timeout = aiohttp.ClientTimeout(total=config.timeout_seconds)
+    scheduler = get_scheduler()
     last_error = "AI service returned an error"
+    last_reason = "provider"
+    last_exc: Exception | None = None
 
-    for attempt in range(2):
+    for attempt in range(config.max_attempts):
+        retry_after = None
         try:
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(AI_CHAT_URL, json=payload, headers=headers) as response:
-                    data = await response.json(content_type=None)
+            with span("upstream.attempt", attempt=attempt, model=payload["model"]):
+                async with scheduler.slot(user_id, priority):
+                    async with get_session("upstream").post(AI_CHAT_URL, json=payload, headers=headers, timeout=timeout) as response:
+                        annotate(status=response.status)
+                        data = await response.json(content_type=None)
+
+                        if response.status >= 400:
+                            message = extract_error_message(data)
+                            last_error = message or f"AI service returned HTTP {response.status}"
+                            last_reason = f"http_{response.status}"
+                            if upstream_failure(response.status):
+                                scheduler.breaker.record_failure()
+                            if response.status not in RETRYABLE_STATUSES:
+                                raise AIProviderError(last_error, last_reason)
+                            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        else:
+                            scheduler.breaker.record_success()
+                            content = extract_assistant_content(data)
+                            if content:
+                                return content
+                            last_error, last_reason = "AI service returned an empty response", "empty_response"
+        except CircuitOpenError as exc:
+            raise AIProviderError("AI service is temporarily unavailable", "circuit_open") from exc
+        except TimeoutError as exc:
+            scheduler.breaker.record_failure()
+            last_error, last_reason, last_exc = "AI service took too long to respond", "timeout", exc
+        except aiohttp.ClientError as exc:
+            scheduler.breaker.record_failure()
+            last_error, last_reason, last_exc = "Could not connect to the AI service", "connection", exc
+
+        if not await wait_before_retry(attempt, config, retry_after):
+            break
 
+    raise AIProviderError(last_error, last_reason) from last_exc
+
+
+async def stream_completion(
+    messages: list[dict[str, Any]],
+    temperature: float,
+    max_tokens: int,
+    user_id: str = "",
+    priority: int = PRIORITY_CHAT,
+    model: str | None = None,
+) -> AsyncIterator[str]:
+    config = get_ai_config()
+
+    if not config.api_key:
+        raise AIProviderError("AI service is not configured", "not_configured")
+
+    payload, headers = build_completion_request(config, messages, temperature, max_tokens, stream=True, model=model)
+    timeout = aiohttp.ClientTimeout(total=config.timeout_seconds)
+    scheduler = get_scheduler()
+    last_error = "AI service returned an error"
+    last_reason = "provider"
+    last_exc: Exception | None = None
+
+    for attempt in range(config.max_attempts):
+        retry_after = None
+        emitted = False
+        try:
+            async with scheduler.slot(user_id, priority):
+                async with get_session("upstream").post(AI_CHAT_URL, json=payload, headers=headers, timeout=timeout) as response:
                     if response.status >= 400:
+                        data = await response.json(content_type=None)
                         message = extract_error_message(data)
                         last_error = message or f"AI service returned HTTP {response.status}"
-                        if response.status in {408, 409, 429, 500, 502, 503, 504} and attempt == 0:
-                            await asyncio.sleep(0.35)
-                            continue
-                        raise AIProviderError(last_error)
-
-                    content = extract_assistant_content(data)
-                    if not content:
-                        last_error = "AI service returned an empty response"
-                        if attempt == 0:
-                            await asyncio.sleep(0.35)
-                            continue
-                        raise AIProviderError(last_error)
-
-                    return content
+                        last_reason = f"http_{response.status}"
+                        if upstream_failure(response.status):
+                            scheduler.breaker.record_failure()
+                        if response.status not in RETRYABLE_STATUSES:
+                            raise AIProviderError(last_error, last_reason)
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    else:
+                        scheduler.breaker.record_success()
+                        async for data in iter_stream_events(response):
+                            message = extract_error_message(data) if "error" in data else ""
+                            if message:
+                                raise AIProviderError(message, "stream_error")
+
+                            delta = extract_delta_content(data)
+                            if delta:
+                                emitted = True
+                                yield delta
+
+                        if emitted:
+                            return
+                        last_error, last_reason = "AI service returned an empty response", "empty_response"
+        except CircuitOpenError as exc:
+            raise AIProviderError("AI service is temporarily unavailable", "circuit_open") from exc
         except TimeoutError as exc:
-            last_error = "AI service took too long to respond"
-            if attempt == 0:
-                continue
-            raise AIProviderError(last_error) from exc
+            scheduler.breaker.record_failure()
+            if emitted:
+                raise AIProviderError("AI service took too long to respond", "timeout") from exc
+            last_error, last_reason, last_exc = "AI service took too long to respond", "timeout", exc
         except aiohttp.ClientError as exc:
-            last_error = "Could not connect to the AI service"
-            if attempt == 0:
+            scheduler.breaker.record_failure()
+            if emitted:
+                raise AIProviderError("Could not connect to the AI service", "connection") from exc
+            last_error, last_reason, last_exc = "Could not connect to the AI service", "connection", exc
+
+        if not await wait_before_retry(attempt, config, retry_after):
+            break
+
+    raise AIProviderError(last_error, last_reason) from last_exc
+
+
+async def race_models(
+    config: AIConfig,
+    start: Callable[[str], Awaitable[Any]],
+) -> tuple[str, Any, dict[asyncio.Task, str]]:
+    models = list(config.models)
+    pending: dict[asyncio.Task, str] = {}
+    last_exc: BaseException | None = None
+
+    def launch() -> None:
+        model = models.pop(0)
+        pending[asyncio.create_task(start(model))] = model
+
+    launch()
+    try:
+        while pending:
+            hedge = config.hedge_seconds if models and config.hedge_seconds > 0 else None
+            done, _ = await asyncio.wait(pending, timeout=hedge, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()
                 continue
-            raise AIProviderError(last_error) from exc
 
-    raise AIProviderError(last_error)
+            for task in done:
+                model = pending.pop(task)
+                if task.exception() is None:
+                    return model, task.result(), pending
+                if not isinstance(task.exception(), AIProviderError):
+                    raise task.exception()
+                last_exc = task.exception()
+
+            if not pending and models:
+                launch()
+    except BaseException:
+        await cancel_tasks(pending)
+        raise
+
+    raise last_exc or AIProviderError("AI service returned an error")
+
+
+async def cancel_tasks(tasks: dict[asyncio.Task, str]) -> None:
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def hedged_completion(
+    messages: list[dict[str, Any]],
+    temperature: float,
+    max_tokens: int,
+    config: AIConfig,
+    stats: ResponseStats,
+    user_id: str = "",
+) -> str:
+    async def start(model: str) -> str:
+        return await request_completion(messages, temperature, max_tokens, user_id=user_id, model=model)
+
+    model, content, losers = await race_models(config, start)
+    await cancel_tasks(losers)
+    stats.model = model
+    return content
+
+
+async def hedged_stream_completion(
+    messages: list[dict[str, Any]],
+    temperature: float,
+    max_tokens: int,
+    config: AIConfig,
+    stats: ResponseStats,
+    user_id: str = "",
+) -> AsyncIterator[str]:
+    streams: dict[str, AsyncIterator[str]] = {}
+
+    async def start(model: str) -> str:
+        stream = streams[model] = stream_completion(messages, temperature, max_tokens, user_id=user_id, model=model)
+        return await anext(stream)
+
+    model = None
+    try:
+        with span("upstream.first_delta", prompt_tokens=stats.prompt_tokens):
+            model, first_delta, losers = await race_models(config, start)
+            annotate(model=model)
+            await cancel_tasks(losers)
+    finally:
+        for name, stream in streams.items():
+            if name != model:
+                await stream.aclose()
+
+    winner = streams[model]
+    stats.model = model
+    try:
+        yield first_delta
+        async for delta in winner:
+            yield delta
+    finally:
+        await winner.aclose()
+
+
+async def iter_stream_events(response: aiohttp.ClientResponse) -> AsyncIterator[dict[str, Any]]:
+    async for raw_line in response.content:
+        line = raw_line.decode("utf-8", errors="replace").strip()
+        if not line.startswith("data:"):
+            continue
+
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+
+        try:
+            event = json.loads(data)
+        except json.JSONDecodeError:
+            continue
+
+        if isinstance(event, dict):
+            yield event
 
 
 def normalize_title(title: str) -> str:
     cleaned = re.sub(r"[\n\r\t\"'`]+", " ", title).strip()
-    cleaned = re.sub(r"^(sorry|apologies|apologize|okay|sure|i can|i cannot|i should|приношу извинения|извините|конечно|хорошо)\b[\s,.:;—-]*", "", cleaned, flags=re.IGNORECASE)
+    cleaned = get_classifier().strip("title_filler", cleaned)
     cleaned = re.sub(r"\s+", " ", cleaned)
     cleaned = cleaned.rstrip(".:;,-")
 
@@ -321,6 +738,19 @@ def extract_assistant_content(data: dict[str, Any]) -> str:
     return ""
 
 
+def extract_delta_content(data: dict[str, Any]) -> str:
+    choices = data.get("choices")
+    if not isinstance(choices, list) or not choices or not isinstance(choices[0], dict):
+        return ""
+
+    delta = choices[0].get("delta")
+    if not isinstance(delta, dict):
+        return ""
+
+    content = delta.get("content")
+    return content if isinstance(content, str) else ""
+
+
 def extract_error_message(data: Any) -> str:
     if not isinstance(data, dict):
         return ""
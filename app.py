@@ -1,54 +1,59 @@
 import asyncio
-import json
+import hashlib
 import os
-import re
 import uuid
-from dataclasses import asdict, dataclass, field
-from datetime import datetime, timezone
+from collections import OrderedDict
+from importlib.util import find_spec
 from pathlib import Path
 from time import perf_counter
-from typing import Literal
 
 from dotenv import load_dotenv
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
-from quart import Quart, jsonify, render_template, request
-
-from ai_service import AIProviderError, generate_ai_response, generate_chat_title
+from hypercorn.run import run
+from quart import Quart, Response, g, jsonify, make_response, render_template, request
+
+from ai_service import AIProviderError, ResponseStats, generate_ai_response, generate_ai_response_stream, generate_chat_titles
+from assets import assets
+from compression import CompressionMiddleware
+from classifier import get_classifier
+from events import EventBroker
+from http_pool import close_pools, open_pools
+from metrics import HTTP_DURATION, HTTP_REQUESTS, STAGE_DURATION, STORE_SIZE, TITLE_TASKS, UPSTREAM_ERRORS, UPSTREAM_REQUESTS, registry
+from models import Chat, Message, RawJSON, encode_json, now_iso
+from scheduler import get_scheduler
+from storage import ChatSnapshot, ChatStorage, WriteBehindQueue, create_storage
+from titles import TitleQueue
+from tracing import TracingMiddleware, activate_trace, finish_after_response, finish_trace, span, start_trace
+from web_scraper import page_cache, search_pool, shutdown_parse_pool
 
 BASE_DIR = Path(__file__).resolve().parent
-STORE_PATH = Path(os.getenv("CHAT_STORE_PATH") or ("/tmp/chat_store.json" if os.getenv("VERCEL") else BASE_DIR / "chat_store.json"))
-MAX_CHATS_PER_USER = 3
 
 load_dotenv(BASE_DIR / ".env")
 
-app = Quart(__name__)
-
-Role = Literal["assistant", "user"]
-
-
-@dataclass
-class Message:
-    role: Role
-    content: str
-    timestamp: str
-    elapsed_seconds: float | None = None
-
-
-@dataclass
-class Chat:
-    id: str
-    title: str
-    messages: list[Message] = field(default_factory=list)
-    created_at: str = field(default_factory=lambda: now_iso())
-    updated_at: str = field(default_factory=lambda: now_iso())
-
+STORE_PATH = Path(os.getenv("CHAT_STORE_PATH") or ("/tmp/chat_store.json" if os.getenv("VERCEL") else BASE_DIR / "chat_store.json"))
+DB_PATH = Path(os.getenv("CHAT_DB_PATH") or ("/tmp/chat_store.db" if os.getenv("VERCEL") else BASE_DIR / "chat_store.db"))
+STORE_BACKEND = os.getenv("CHAT_STORE_BACKEND", "sqlite").strip().lower() or "sqlite"
+MAX_CHATS_PER_USER = 3
+MAX_CACHED_USERS = int(os.getenv("CHAT_CACHE_MAX_USERS", "1000"))
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "20"))
+WORKERS = max(int(os.getenv("WORKERS", "1")), 1)
+SHARED_STATE_POLL_SECONDS = float(os.getenv("SHARED_STATE_POLL_SECONDS", "").strip() or ("2" if WORKERS > 1 else "0"))
 
-chat_store: dict[str, list[Chat]] = {}
+if WORKERS > 1 and STORE_BACKEND == "json":
+    raise RuntimeError("CHAT_STORE_BACKEND=json cannot be shared between workers; use sqlite or WORKERS=1")
 
+app = Quart(__name__)
+app.add_template_global(assets.url_for, "asset_url")
+app.asgi_app = TracingMiddleware(CompressionMiddleware(app.asgi_app))
 
-def now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+chat_store: OrderedDict[str, list[Chat]] = OrderedDict()
+known_users: set[str] = set()
+stale_users: set[str] = set()
+storage: ChatStorage
+broker = EventBroker()
+rendered_pages: dict[str, tuple[str, str]] = {}
 
 
 def get_user_id() -> str:
@@ -72,82 +77,180 @@ def create_chat() -> Chat:
     )
 
 
-def load_store() -> None:
-    if not STORE_PATH.exists():
-        return
+def load_user_index() -> None:
+    known_users.update(storage.user_ids())
 
-    try:
-        raw = json.loads(STORE_PATH.read_text(encoding="utf-8"))
-    except (OSError, json.JSONDecodeError):
-        return
 
-    for user_id, chats in raw.items():
-        if not isinstance(chats, list):
+def parse_chats(chats: list[dict]) -> list[Chat]:
+    parsed_chats = []
+    for item in chats:
+        if not isinstance(item, dict):
             continue
 
-        parsed_chats = []
-        for item in chats:
-            if not isinstance(item, dict):
+        messages = []
+        for message in item.get("messages", []):
+            if not isinstance(message, dict):
                 continue
-
-            messages = []
-            for message in item.get("messages", []):
-                if not isinstance(message, dict):
-                    continue
-                role = message.get("role")
-                content = message.get("content")
-                timestamp = message.get("timestamp") or now_iso()
-                elapsed_seconds = message.get("elapsed_seconds")
-                if role in {"assistant", "user"} and isinstance(content, str):
-                    messages.append(
-                        Message(
-                            role=role,
-                            content=content,
-                            timestamp=timestamp,
-                            elapsed_seconds=elapsed_seconds if isinstance(elapsed_seconds, (int, float)) else None,
-                        )
+            role = message.get("role")
+            content = message.get("content")
+            timestamp = message.get("timestamp") or now_iso()
+            elapsed_seconds = message.get("elapsed_seconds")
+            first_token_seconds = message.get("first_token_seconds")
+            model = message.get("model")
+            if role in {"assistant", "user"} and isinstance(content, str):
+                messages.append(
+                    Message(
+                        role=role,
+                        content=content,
+                        timestamp=timestamp,
+                        elapsed_seconds=elapsed_seconds if isinstance(elapsed_seconds, (int, float)) else None,
+                        first_token_seconds=first_token_seconds if isinstance(first_token_seconds, (int, float)) else None,
+                        model=model if isinstance(model, str) else None,
                     )
-
-            parsed_chats.append(
-                Chat(
-                    id=str(item.get("id") or f"chat_{len(parsed_chats)}"),
-                    title=str(item.get("title") or "New conversation"),
-                    messages=messages or [default_message()],
-                    created_at=str(item.get("created_at") or now_iso()),
-                    updated_at=str(item.get("updated_at") or now_iso()),
                 )
+
+        parsed_chats.append(
+            Chat(
+                id=str(item.get("id") or f"chat_{len(parsed_chats)}"),
+                title=str(item.get("title") or "New conversation"),
+                messages=messages or [default_message()],
+                created_at=str(item.get("created_at") or now_iso()),
+                updated_at=str(item.get("updated_at") or now_iso()),
             )
+        )
 
-        chat_store[user_id] = sort_chats(parsed_chats)[:MAX_CHATS_PER_USER]
+    return sort_chats(parsed_chats)[:MAX_CHATS_PER_USER]
+
+
+async def cached_user_chats(user_id: str) -> list[Chat]:
+    cached = chat_store.get(user_id)
+    stale = user_id in stale_users and not writer.is_dirty(user_id)
+    if cached is None or stale:
+        stale_users.discard(user_id)
+        chats = parse_chats(await asyncio.to_thread(storage.load_user, user_id)) if WORKERS > 1 or stale or user_id in known_users else []
+        if chat_store.get(user_id) is cached and (cached is None or not writer.is_dirty(user_id)):
+            chat_store[user_id] = chats
+            chat_store.move_to_end(user_id)
+            evict_idle_users()
+            return chats
+    chat_store.move_to_end(user_id)
+    return chat_store[user_id]
 
 
-def save_store() -> None:
-    data = {
-        user_id: [serialize_chat(chat, include_messages=True) for chat in sort_chats(chats)[:MAX_CHATS_PER_USER]]
-        for user_id, chats in chat_store.items()
-    }
-    STORE_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+def evict_idle_users() -> None:
+    for user_id in list(chat_store)[:-1]:
+        if len(chat_store) <= MAX_CACHED_USERS:
+            return
+        if not writer.is_dirty(user_id):
+            del chat_store[user_id]
+
+
+async def attach_chat(user_id: str, chat: Chat) -> None:
+    chats = await cached_user_chats(user_id)
+    for index, item in enumerate(chats):
+        if item.id == chat.id:
+            chats[index] = chat
+            return
+
+
+def snapshot_chat(user_id: str, chat_id: str, start: int) -> ChatSnapshot | None:
+    for chat in chat_store.get(user_id, []):
+        if chat.id == chat_id:
+            if start > len(chat.messages):
+                start = 0
+            return chat.to_dict(), [message.to_json() for message in chat.messages[start:]], start
+    return None
+
+
+async def rebase_user_chats(user_id: str, starts: dict[str, int], deleted: set[str]) -> None:
+    local = chat_store.get(user_id)
+    if local is None:
+        return
+
+    chat_ids = [chat.id for chat in local]
+    bases = await asyncio.to_thread(lambda: {chat_id: storage.message_count(user_id, chat_id) for chat_id in chat_ids})
+    bases.update(starts)
+    fresh = {chat.id: chat for chat in parse_chats(await asyncio.to_thread(storage.load_user, user_id))}
+
+    merged = []
+    for chat in chat_store.get(user_id, []):
+        current = fresh.pop(chat.id, None)
+        if chat.id in deleted:
+            continue
+        start = bases.get(chat.id, 0)
+        if chat.id in starts or (user_id, chat.id) in writer.pending:
+            if current is None or start == 0 or writer.pending.get((user_id, chat.id)):
+                writer.mark_chat(user_id, chat.id, replace_messages=True)
+            else:
+                chat.messages = current.messages + chat.messages[start:]
+                writer.mark_chat(user_id, chat.id)
+        elif current is not None:
+            chat.title, chat.messages, chat.created_at, chat.updated_at = current.title, current.messages, current.created_at, current.updated_at
+        else:
+            continue
+        merged.append(chat)
+
+    merged.extend(chat for chat_id, chat in fresh.items() if chat_id not in deleted)
+    chat_store[user_id] = merged
+    writer.mark_deleted(user_id, sorted(deleted))
+    await trim_user_chats(user_id)
+    publish_chats(user_id)
+
+
+writer: WriteBehindQueue
+
+
+def open_storage() -> None:
+    global storage, writer
+    storage = create_storage(STORE_BACKEND, DB_PATH, STORE_PATH)
+    writer = WriteBehindQueue(
+        storage,
+        snapshot_chat,
+        rebase_user_chats,
+        debounce_seconds=float(os.getenv("CHAT_STORE_FLUSH_SECONDS", "").strip() or ("0.1" if WORKERS > 1 else "1.0")),
+        max_pending=int(os.getenv("CHAT_STORE_FLUSH_MAX_PENDING", "50")),
+    )
+    load_user_index()
+
+
+def persist_chat(user_id: str, chat: Chat, replace_messages: bool = False) -> None:
+    writer.mark_chat(user_id, chat.id, replace_messages=replace_messages)
+    publish_chats(user_id)
+
+
+def publish_chats(user_id: str) -> None:
+    if not broker.has_subscribers(user_id):
+        return
+
+    chats_json = RawJSON("[" + ",".join(serialize_chat(chat) for chat in sort_chats(chat_store.get(user_id, []))) + "]")
+    broker.publish(user_id, "chats", {"chats": chats_json, "chats_version": content_version(chats_json)})
 
 
 def sort_chats(chats: list[Chat]) -> list[Chat]:
     return sorted(chats, key=lambda chat: chat.updated_at, reverse=True)
 
 
-def trim_user_chats(user_id: str) -> None:
-    chat_store[user_id] = sort_chats(chat_store.get(user_id, []))[:MAX_CHATS_PER_USER]
+async def trim_user_chats(user_id: str) -> None:
+    chats = sort_chats(await cached_user_chats(user_id))
+    chat_store[user_id] = chats[:MAX_CHATS_PER_USER]
+    removed = [chat.id for chat in chats[MAX_CHATS_PER_USER:]]
+    writer.mark_deleted(user_id, removed)
+    title_queue.forget(user_id, removed)
 
 
-def get_user_chats(user_id: str) -> list[Chat]:
-    chats = chat_store.setdefault(user_id, [])
+async def get_user_chats(user_id: str) -> list[Chat]:
+    chats = await cached_user_chats(user_id)
     if not chats:
-        chats.append(create_chat())
-        trim_user_chats(user_id)
-        save_store()
+        new_item = create_chat()
+        chats.append(new_item)
+        known_users.add(user_id)
+        await trim_user_chats(user_id)
+        persist_chat(user_id, new_item)
     return chat_store[user_id]
 
 
-def get_chat(user_id: str, chat_id: str | None = None) -> Chat:
-    chats = get_user_chats(user_id)
+async def get_chat(user_id: str, chat_id: str | None = None) -> Chat:
+    chats = await get_user_chats(user_id)
     if chat_id:
         for chat in chats:
             if chat.id == chat_id:
@@ -156,26 +259,63 @@ def get_chat(user_id: str, chat_id: str | None = None) -> Chat:
     return sort_chats(chats)[0]
 
 
-def touch_chat(user_id: str, chat: Chat) -> None:
+async def touch_chat(user_id: str, chat: Chat, replace_messages: bool = False) -> None:
     chat.updated_at = now_iso()
-    trim_user_chats(user_id)
-    save_store()
+    await attach_chat(user_id, chat)
+    await trim_user_chats(user_id)
+    persist_chat(user_id, chat, replace_messages=replace_messages)
 
 
-def serialize_chat(chat: Chat, include_messages: bool = False) -> dict:
-    data = {
-        "id": chat.id,
-        "title": chat.title,
-        "created_at": chat.created_at,
-        "updated_at": chat.updated_at,
-    }
-    if include_messages:
-        data["messages"] = [asdict(message) for message in chat.messages]
-    return data
+def serialize_chat(chat: Chat, include_messages: bool = False, start: int = 0) -> RawJSON:
+    return chat.to_json(include_messages=include_messages, start=start)
+
+
+async def serialize_chats(user_id: str) -> RawJSON:
+    return RawJSON("[" + ",".join(serialize_chat(chat) for chat in sort_chats(await get_user_chats(user_id))) + "]")
+
+
+def content_version(*parts: str) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def chat_version(chat: Chat) -> str:
+    last_timestamp = chat.messages[-1].timestamp if chat.messages else ""
+    return content_version(serialize_chat(chat), str(len(chat.messages)), last_timestamp)
+
+
+def message_cursor(chat: Chat, since: object, anchor: object) -> int:
+    try:
+        position = int(since)
+    except (TypeError, ValueError):
+        return 0
+
+    if 0 < position <= len(chat.messages) and chat.messages[position - 1].timestamp == anchor:
+        return position
+    return 0
 
 
-def serialize_chats(user_id: str) -> list[dict]:
-    return [serialize_chat(chat) for chat in sort_chats(get_user_chats(user_id))]
+def json_response(payload: dict, status: int = 200, etag: str | None = None) -> Response:
+    response = Response(encode_json(payload), status=status, mimetype="application/json")
+    if etag:
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["Vary"] = "X-User-Session-ID"
+    return response
+
+
+def not_modified(etag: str) -> Response | None:
+    if not request.if_none_match.contains_weak(etag):
+        return None
+
+    response = Response("", status=304)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "X-User-Session-ID"
+    return response
 
 
 def model_history(chat: Chat) -> list[dict[str, str]]:
@@ -186,67 +326,319 @@ def model_history(chat: Chat) -> list[dict[str, str]]:
     ]
 
 
-async def refresh_chat_title(chat: Chat, force: bool = False) -> None:
-    if chat.title != "New conversation" and not force:
-        return
-
-    dialogue = [message for message in chat.messages if message.role == "user"]
-    if not dialogue:
-        return
-
-    try:
-        chat.title = await generate_chat_title(model_history(chat))
-    except AIProviderError:
-        chat.title = fallback_title(chat)
-    except Exception:
-        chat.title = fallback_title(chat)
-
-
 def fallback_title(chat: Chat) -> str:
     for message in chat.messages:
         if message.role == "user" and message.content.strip():
-            content = re.sub(r"https?://\S+", "", message.content.strip())
-            content = re.sub(r"^(поищи|найди|загугли|расскажи|напиши|дай|сделай|что это|what is|search|find|tell me)\s+", "", content, flags=re.IGNORECASE)
+            content = get_classifier().strip("url", message.content.strip())
+            content = get_classifier().strip("title_command", content)
             words = content.split()
             title = " ".join(words[:5]).strip(".,:;!?")
             return title[:48] or "New conversation"
     return "New conversation"
 
 
-async def refresh_chat_title_background(user_id: str, chat_id: str) -> None:
-    try:
-        target_chat = get_chat(user_id, chat_id)
-        old_title = target_chat.title
-        await refresh_chat_title(target_chat, force=True)
-        if target_chat.title != old_title:
-            save_store()
-    except Exception as exc:
-        print(f"Chat title refresh failed: {exc}")
+def find_chat(user_id: str, chat_id: str) -> Chat | None:
+    return next((chat for chat in chat_store.get(user_id, []) if chat.id == chat_id), None)
+
+
+def title_history(user_id: str, chat_id: str) -> list[dict[str, str]] | None:
+    chat = find_chat(user_id, chat_id)
+    return model_history(chat) if chat is not None else None
+
+
+def apply_chat_title(user_id: str, chat_id: str, title: str) -> None:
+    target_chat = find_chat(user_id, chat_id)
+    if target_chat is None:
+        return
+
+    title = title or (fallback_title(target_chat) if target_chat.title == "New conversation" else target_chat.title)
+    if title != target_chat.title:
+        target_chat.title = title
+        broker.publish(user_id, "title", {"chat_id": target_chat.id, "title": target_chat.title})
+        persist_chat(user_id, target_chat)
+
+
+title_queue = TitleQueue(
+    title_history,
+    generate_chat_titles,
+    apply_chat_title,
+    debounce_seconds=float(os.getenv("TITLE_DEBOUNCE_SECONDS", "4")),
+    max_batch=int(os.getenv("TITLE_BATCH_SIZE", "8")),
+    refresh_turns=int(os.getenv("TITLE_REFRESH_TURNS", "2")),
+)
+
+
+shared_state_tasks: set[asyncio.Task] = set()
+
+
+async def watch_shared_state() -> None:
+    while True:
+        await asyncio.sleep(SHARED_STATE_POLL_SECONDS)
+        try:
+            cached = [user_id for user_id in chat_store if not writer.is_dirty(user_id)]
+            stale_users.update(await asyncio.to_thread(storage.stale_users, cached))
+        except Exception as exc:
+            print(f"Shared state refresh failed: {exc}")
+            continue
+
+        for user_id in list(broker.subscribers):
+            if user_id not in stale_users or writer.is_dirty(user_id):
+                continue
+            try:
+                await cached_user_chats(user_id)
+                publish_chats(user_id)
+            except Exception as exc:
+                print(f"Shared state refresh failed: {exc}")
+
+
+@app.before_serving
+async def startup() -> None:
+    await asyncio.to_thread(open_storage)
+    await asyncio.to_thread(assets.build)
+    rendered_pages.clear()
+    await open_pools()
+    writer.start()
+    title_queue.start()
+    if WORKERS > 1 and SHARED_STATE_POLL_SECONDS > 0:
+        shared_state_tasks.add(asyncio.create_task(watch_shared_state()))
+
+
+@app.after_serving
+async def shutdown() -> None:
+    for task in shared_state_tasks:
+        task.cancel()
+    shared_state_tasks.clear()
+    await title_queue.close()
+    await close_pools()
+    await writer.close()
+    await asyncio.to_thread(storage.compact)
+    search_pool.shutdown()
+    shutdown_parse_pool()
+
+
+async def static_page(template: str) -> Response:
+    cached = rendered_pages.get(template)
+    if cached is None or app.debug:
+        body = await render_template(template)
+        cached = rendered_pages[template] = (body, content_version(body))
+
+    body, etag = cached
+    if request.if_none_match.contains_weak(etag):
+        response = Response("", status=304)
+    else:
+        response = Response(body, content_type="text/html; charset=utf-8")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @app.get("/")
 async def index():
-    return await render_template("index.html")
+    return await static_page("index.html")
 
 
 @app.get("/privacy-policy")
 async def privacy_policy():
-    return await render_template("privacy-policy.html")
+    return await static_page("privacy-policy.html")
+
+
+@app.get("/assets/<path:name>")
+async def asset_file(name: str):
+    asset = assets.get(name)
+    if asset is None:
+        return jsonify({"error": "Asset not found"}), 404
+
+    if request.if_none_match.contains_weak(asset.etag):
+        response = Response("", status=304)
+    else:
+        encoding = asset.encoding_for(request.accept_encodings.quality)
+        response = Response(asset.bodies[encoding], content_type=asset.content_type)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(asset.etag)
+    response.headers["Cache-Control"] = ASSET_CACHE_CONTROL
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+@app.before_request
+async def start_request() -> None:
+    g.request_started_at = perf_counter()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    g.trace = start_trace(f"{request.method} {route}", request.headers.get("X-Request-ID", "").strip()[:64] or None)
+    g.trace_deferred = finish_after_response(g.trace)
+
+
+@app.after_request
+async def finish_request(response: Response) -> Response:
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    started_at = getattr(g, "request_started_at", None)
+    if started_at is not None:
+        HTTP_DURATION.observe(perf_counter() - started_at, method=request.method, route=route)
+
+    trace = getattr(g, "trace", None)
+    if trace is not None:
+        response.headers["X-Request-ID"] = trace.request_id
+        trace.attributes["status"] = response.status_code
+        if not getattr(g, "trace_deferred", False):
+            finish_trace(trace)
+    return response
+
+
+def store_size() -> dict[tuple[str, ...], float]:
+    store_files = [DB_PATH, DB_PATH.with_name(f"{DB_PATH.name}-wal")] if STORE_BACKEND == "sqlite" else [STORE_PATH]
+    return {
+        ("known_users",): len(known_users),
+        ("cached_users",): len(chat_store),
+        ("cached_chats",): sum(len(chats) for chats in chat_store.values()),
+        ("pending_writes",): len(writer.pending),
+        ("bytes",): sum(path.stat().st_size for path in store_files if path.exists()),
+    }
+
+
+def upstream_requests() -> dict[tuple[str, ...], float]:
+    stats = get_scheduler().stats()
+    return {("in_flight",): stats["in_flight"], ("queued",): stats["queued"]}
+
+
+STORE_SIZE.set_function(store_size)
+TITLE_TASKS.set_function(lambda: {("pending",): len(title_queue.pending), ("in_flight",): title_queue.in_flight})
+UPSTREAM_REQUESTS.set_function(upstream_requests)
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/health")
+async def health():
+    return jsonify({"status": "ok", "persistence": writer.stats(), "page_cache": page_cache.stats(), "search": search_pool.stats(), "upstream": get_scheduler().stats(), "titles": title_queue.stats()})
 
 
 @app.get("/api/chats")
 async def chats():
     user_id = get_user_id()
-    active_chat = get_chat(user_id)
-    return jsonify({"chats": serialize_chats(user_id), "active_chat_id": active_chat.id})
+    active_chat = await get_chat(user_id)
+    chats_json = await serialize_chats(user_id)
+    chats_version = content_version(chats_json)
+    etag = content_version(chats_version, active_chat.id)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    return json_response({"chats": chats_json, "chats_version": chats_version, "active_chat_id": active_chat.id}, etag=etag)
 
 
 @app.get("/api/history")
 async def history():
     user_id = get_user_id()
     chat_id = request.args.get("chat_id")
-    chat = get_chat(user_id, chat_id)
-    return jsonify({"chat": serialize_chat(chat, include_messages=True), "chats": serialize_chats(user_id)})
+    chat = await get_chat(user_id, chat_id)
+    offset = message_cursor(chat, request.args.get("since"), request.args.get("anchor"))
+    chats_json = await serialize_chats(user_id)
+    chats_version = content_version(chats_json)
+    etag = content_version(chat_version(chat), str(offset), chats_version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    return json_response(
+        {
+            "chat": serialize_chat(chat, include_messages=True, start=offset),
+            "offset": offset,
+            "chats": chats_json,
+            "chats_version": chats_version,
+        },
+        etag=etag,
+    )
+
+
+@app.get("/api/events")
+async def event_stream():
+    user_id = request.args.get("session_id", "").strip() or get_user_id()
+
+    async def stream():
+        queue = broker.subscribe(user_id)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=EVENTS_KEEPALIVE_SECONDS)
+                except TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_event(event, data)
+        finally:
+            broker.unsubscribe(user_id, queue)
+
+    response = await make_response(
+        stream(),
+        200,
+        {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.timeout = None
+    return response
+
+
+def discard_message(user_id: str, chat: Chat, message: Message) -> None:
+    for index, item in enumerate(chat.messages):
+        if item is message:
+            del chat.messages[index]
+            writer.mark_chat(user_id, chat.id, replace_messages=True)
+            return
+
+
+async def complete_chat_turn(
+    user_id: str,
+    chat: Chat,
+    response: str,
+    elapsed_seconds: float,
+    first_token_seconds: float | None = None,
+    offset: int = 0,
+    known_chats_version: str | None = None,
+    stats: ResponseStats | None = None,
+) -> dict:
+    chat.messages.append(
+        Message(
+            role="assistant",
+            content=response,
+            timestamp=now_iso(),
+            elapsed_seconds=elapsed_seconds,
+            first_token_seconds=first_token_seconds,
+            model=stats.model if stats else None,
+        )
+    )
+    if chat.title == "New conversation":
+        chat.title = fallback_title(chat)
+    await touch_chat(user_id, chat)
+    title_queue.schedule(user_id, chat.id, model_history(chat))
+
+    started_at = perf_counter()
+    with span("response.build"):
+        chats_json = await serialize_chats(user_id)
+        chats_version = content_version(chats_json)
+        payload = {
+            "response": response,
+            "elapsed_seconds": elapsed_seconds,
+            "first_token_seconds": first_token_seconds,
+            "chat": serialize_chat(chat, include_messages=True, start=offset),
+            "offset": offset,
+            "chats_version": chats_version,
+            "timestamp": chat.messages[-1].timestamp,
+            "timings": stats.timings if stats else {},
+            "prompt_tokens": stats.prompt_tokens if stats else None,
+            "model": stats.model if stats else None,
+        }
+        if chats_version != known_chats_version:
+            payload["chats"] = chats_json
+    STAGE_DURATION.observe(perf_counter() - started_at, stage="response_build")
+    return payload
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {encode_json(data)}\n\n"
 
 
 @app.post("/api/chat")
@@ -259,47 +651,116 @@ async def chat():
         return jsonify({"error": "Type a message before sending."}), 400
 
     user_id = get_user_id()
-    current_chat = get_chat(user_id, chat_id)
+    current_chat = await get_chat(user_id, chat_id)
     history_for_model = model_history(current_chat)
+    offset = message_cursor(current_chat, data.get("since"), data.get("anchor"))
+    known_chats_version = data.get("chats_version")
 
-    current_chat.messages.append(Message(role="user", content=user_message, timestamp=now_iso()))
+    user_entry = Message(role="user", content=user_message, timestamp=now_iso())
+    current_chat.messages.append(user_entry)
 
+    stats = ResponseStats()
     try:
         started_at = perf_counter()
-        response = await generate_ai_response(user_message, history_for_model)
+        response = await generate_ai_response(user_message, history_for_model, stats, user_id)
         elapsed_seconds = round(perf_counter() - started_at, 2)
     except asyncio.CancelledError:
+        discard_message(user_id, current_chat, user_entry)
         raise
     except AIProviderError as exc:
         print(f"AI response failed: {exc}")
-        current_chat.messages.pop()
+        UPSTREAM_ERRORS.inc(reason=exc.reason)
+        g.trace.attributes["error"] = exc.reason
+        discard_message(user_id, current_chat, user_entry)
         return jsonify({"error": "bearCode could not answer right now. Please try again."}), 502
     except Exception:
-        current_chat.messages.pop()
+        discard_message(user_id, current_chat, user_entry)
         return jsonify({"error": "Something went wrong while generating a response."}), 500
 
-    current_chat.messages.append(
-        Message(
-            role="assistant",
-            content=response,
-            timestamp=now_iso(),
-            elapsed_seconds=elapsed_seconds,
+    return json_response(
+        await complete_chat_turn(
+            user_id,
+            current_chat,
+            response,
+            elapsed_seconds,
+            offset=offset,
+            known_chats_version=known_chats_version,
+            stats=stats,
         )
     )
-    if current_chat.title == "New conversation":
-        current_chat.title = fallback_title(current_chat)
-    touch_chat(user_id, current_chat)
-    asyncio.create_task(refresh_chat_title_background(user_id, current_chat.id))
 
-    return jsonify(
-        {
-            "response": response,
-            "elapsed_seconds": elapsed_seconds,
-            "chat": serialize_chat(current_chat, include_messages=True),
-            "chats": serialize_chats(user_id),
-            "timestamp": current_chat.messages[-1].timestamp,
-        }
+
+@app.post("/api/chat/stream")
+async def chat_stream():
+    data = await request.get_json(silent=True) or {}
+    chat_id = str(data.get("chat_id") or "").strip() or None
+    user_message = str(data.get("message") or "").strip()
+
+    if not user_message:
+        return jsonify({"error": "Type a message before sending."}), 400
+
+    user_id = get_user_id()
+    current_chat = await get_chat(user_id, chat_id)
+    history_for_model = model_history(current_chat)
+    offset = message_cursor(current_chat, data.get("since"), data.get("anchor"))
+    known_chats_version = data.get("chats_version")
+
+    user_entry = Message(role="user", content=user_message, timestamp=now_iso())
+    current_chat.messages.append(user_entry)
+    trace = g.trace
+
+    async def events():
+        activate_trace(trace)
+        started_at = perf_counter()
+        first_token_seconds = None
+        parts = []
+        stats = ResponseStats()
+        completed = False
+
+        try:
+            try:
+                async for delta in generate_ai_response_stream(user_message, history_for_model, stats, user_id):
+                    if first_token_seconds is None:
+                        first_token_seconds = round(perf_counter() - started_at, 2)
+                    parts.append(delta)
+                    yield sse_event("delta", {"content": delta})
+            except AIProviderError as exc:
+                print(f"AI response failed: {exc}")
+                UPSTREAM_ERRORS.inc(reason=exc.reason)
+                trace.attributes["error"] = exc.reason
+                discard_message(user_id, current_chat, user_entry)
+                yield sse_event("error", {"error": "bearCode could not answer right now. Please try again."})
+                return
+            except Exception:
+                discard_message(user_id, current_chat, user_entry)
+                yield sse_event("error", {"error": "Something went wrong while generating a response."})
+                return
+
+            elapsed_seconds = round(perf_counter() - started_at, 2)
+            response = "".join(parts).strip()
+            payload = await complete_chat_turn(
+                user_id,
+                current_chat,
+                response,
+                elapsed_seconds,
+                first_token_seconds,
+                offset=offset,
+                known_chats_version=known_chats_version,
+                stats=stats,
+            )
+            completed = True
+            yield sse_event("done", payload)
+        finally:
+            if not completed:
+                discard_message(user_id, current_chat, user_entry)
+
+    response = await make_response(
+        events(),
+        200,
+        {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+    response.timeout = None
+    return response
 
 
 @app.post("/api/clear")
@@ -307,21 +768,40 @@ async def clear_chat():
     data = await request.get_json(silent=True) or {}
     user_id = get_user_id()
     chat_id = str(data.get("chat_id") or "").strip() or None
-    current_chat = get_chat(user_id, chat_id)
+    current_chat = await get_chat(user_id, chat_id)
     current_chat.title = "New conversation"
     current_chat.messages = [default_message()]
-    touch_chat(user_id, current_chat)
-    return jsonify({"status": "success", "chat": serialize_chat(current_chat, include_messages=True), "chats": serialize_chats(user_id)})
+    await touch_chat(user_id, current_chat, replace_messages=True)
+    chats_json = await serialize_chats(user_id)
+    return json_response(
+        {
+            "status": "success",
+            "chat": serialize_chat(current_chat, include_messages=True),
+            "offset": 0,
+            "chats": chats_json,
+            "chats_version": content_version(chats_json),
+        }
+    )
 
 
 @app.post("/api/new")
 async def new_chat():
     user_id = get_user_id()
     new_item = create_chat()
-    chat_store.setdefault(user_id, []).insert(0, new_item)
-    trim_user_chats(user_id)
-    save_store()
-    return jsonify({"status": "success", "chat": serialize_chat(new_item, include_messages=True), "chats": serialize_chats(user_id)})
+    (await cached_user_chats(user_id)).insert(0, new_item)
+    known_users.add(user_id)
+    await trim_user_chats(user_id)
+    persist_chat(user_id, new_item)
+    chats_json = await serialize_chats(user_id)
+    return json_response(
+        {
+            "status": "success",
+            "chat": serialize_chat(new_item, include_messages=True),
+            "offset": 0,
+            "chats": chats_json,
+            "chats_version": content_version(chats_json),
+        }
+    )
 
 
 @app.errorhandler(404)
@@ -339,13 +819,24 @@ async def server_error(_error):
     return jsonify({"error": "Internal server error."}), 500
 
 
-load_store()
+def serve_workers(host: str, port: int) -> None:
+    config = Config()
+    config.bind = [f"{host}:{port}"]
+    config.workers = WORKERS
+    config.application_path = "app:app"
+    config.worker_class = "uvloop" if os.getenv("UVLOOP", "").strip() == "1" and find_spec("uvloop") else "asyncio"
+    print(f"bearCode is running at http://{host}:{port} with {WORKERS} {config.worker_class} workers")
+    run(config)
 
 
 if __name__ == "__main__":
+    host = os.getenv("HOST", "127.0.0.1").strip() or "127.0.0.1"
     port = int(os.getenv("PORT", "8080"))
-    config = Config()
-    config.bind = [f"127.0.0.1:{port}"]
-    config.use_reloader = os.getenv("ENVIRONMENT") != "production"
-    print(f"bearCode is running at http://127.0.0.1:{port}")
-    asyncio.run(serve(app, config))
+    if WORKERS > 1:
+        serve_workers(host, port)
+    else:
+        config = Config()
+        config.bind = [f"{host}:{port}"]
+        config.use_reloader = os.getenv("ENVIRONMENT") != "production"
+        print(f"bearCode is running at http://{host}:{port}")
+        asyncio.run(serve(app, config))
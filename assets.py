@@ -0,0 +1,173 @@
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import sys
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+BASE_DIR = Path(__file__).resolve().parent
+STATIC_DIR = BASE_DIR / "static"
+ASSET_CACHE_DIR = Path(os.getenv("ASSET_CACHE_DIR") or ("/tmp/asset-cache" if os.getenv("VERCEL") else BASE_DIR / ".asset-cache"))
+ASSET_URL_PREFIX = "/assets/"
+ASSET_IMAGE_QUALITY = int(os.getenv("ASSET_IMAGE_QUALITY", "70"))
+ASSET_IMAGE_FORMATS = tuple(item.strip().lower() for item in os.getenv("ASSET_IMAGE_FORMATS", "avif,webp").split(",") if item.strip())
+MIN_COMPRESS_BYTES = 512
+CONVERTIBLE_IMAGES = {".png", ".jpg", ".jpeg"}
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+IMAGE_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+CSS_URL_PATTERN = re.compile(r"""url\((["']?)/static/([^"')]+)\1\)""")
+CSS_BACKGROUND_PATTERN = re.compile(r"""^([ \t]*)background-image:\s*url\((["']?)/static/([^"')]+)\2\);""", re.MULTILINE)
+
+
+@dataclass(slots=True)
+class Asset:
+    path: str
+    url: str
+    content_type: str
+    etag: str
+    bodies: dict[str, bytes] = field(default_factory=dict)
+
+    def encoding_for(self, quality: Callable[[str], float]) -> str:
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and quality(encoding) > 0:
+                return encoding
+        return "identity"
+
+
+def content_type_for(path: str) -> str:
+    content_type = IMAGE_TYPES.get(Path(path).suffix.lstrip(".")) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type == "application/javascript":
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+def compress_variants(data: bytes, content_type: str) -> dict[str, bytes]:
+    bodies = {"identity": data}
+    if len(data) < MIN_COMPRESS_BYTES or not content_type.startswith(COMPRESSIBLE_TYPES):
+        return bodies
+
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data):
+        bodies["gzip"] = compressed
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            bodies["br"] = compressed
+    return bodies
+
+
+class AssetManifest:
+    def __init__(self, static_dir: Path = STATIC_DIR, cache_dir: Path = ASSET_CACHE_DIR, image_formats: tuple[str, ...] = ASSET_IMAGE_FORMATS):
+        self.static_dir = static_dir
+        self.cache_dir = cache_dir
+        self.image_formats = image_formats
+        self.urls: dict[str, str] = {}
+        self.assets: dict[str, Asset] = {}
+        self.images: dict[str, list[str]] = {}
+
+    def build(self) -> None:
+        self.urls, self.assets, self.images = {}, {}, {}
+        files = [path for path in self.static_dir.rglob("*") if path.is_file()]
+        for path in sorted(files, key=lambda item: (item.suffix == ".css", item.as_posix())):
+            logical = path.relative_to(self.static_dir).as_posix()
+            data = path.read_bytes()
+            if path.suffix == ".css":
+                data = self.rewrite_css(data.decode("utf-8")).encode("utf-8")
+            self.add(logical, data)
+            if path.suffix.lower() in CONVERTIBLE_IMAGES:
+                self.add_image_variants(logical, data)
+
+    def add(self, logical: str, data: bytes) -> Asset:
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        path = Path(logical)
+        name = path.with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+        content_type = content_type_for(logical)
+        asset = Asset(logical, ASSET_URL_PREFIX + name, content_type, digest, compress_variants(data, content_type))
+        self.urls[logical] = asset.url
+        self.assets[name] = asset
+        return asset
+
+    def add_image_variants(self, logical: str, data: bytes) -> None:
+        for image_format in self.image_formats:
+            converted = self.convert_image(logical, data, image_format)
+            if converted is not None and len(converted) < len(data):
+                variant = Path(logical).with_suffix(f".{image_format}").as_posix()
+                self.add(variant, converted)
+                self.images.setdefault(logical, []).append(variant)
+
+    def convert_image(self, logical: str, data: bytes, image_format: str) -> bytes | None:
+        if Image is None or image_format not in IMAGE_TYPES:
+            return None
+
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        cached = self.cache_dir / f"{Path(logical).stem}.{digest}.q{ASSET_IMAGE_QUALITY}.{image_format}"
+        if cached.exists():
+            return cached.read_bytes()
+
+        buffer = io.BytesIO()
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.save(buffer, format=image_format.upper(), quality=ASSET_IMAGE_QUALITY)
+        except (KeyError, OSError, ValueError) as exc:
+            print(f"Could not convert {logical} to {image_format}: {exc}")
+            return None
+
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            cached.write_bytes(buffer.getvalue())
+        except OSError:
+            pass
+        return buffer.getvalue()
+
+    def rewrite_css(self, text: str) -> str:
+        def background(match: re.Match) -> str:
+            indent, logical = match.group(1), match.group(3)
+            declaration = f'{indent}background-image: url("{self.url_for(logical)}");'
+            variants = self.images.get(logical)
+            if not variants:
+                return declaration
+            options = [f'url("{self.url_for(item)}") type("{content_type_for(item)}")' for item in [*variants, logical]]
+            return f"{declaration}\n{indent}background-image: image-set({', '.join(options)});"
+
+        text = CSS_BACKGROUND_PATTERN.sub(background, text)
+        return CSS_URL_PATTERN.sub(lambda match: f'url("{self.url_for(match.group(2))}")', text)
+
+    def url_for(self, logical: str) -> str:
+        logical = logical.lstrip("/")
+        return self.urls.get(logical, f"/static/{logical}")
+
+    def get(self, name: str) -> Asset | None:
+        return self.assets.get(name)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "assets": len(self.assets),
+            "identity_bytes": sum(len(asset.bodies["identity"]) for asset in self.assets.values()),
+            "encoded_bytes": sum(len(body) for asset in self.assets.values() for encoding, body in asset.bodies.items() if encoding != "identity"),
+        }
+
+
+assets = AssetManifest()
+
+
+if __name__ == "__main__":
+    assets.build()
+    for asset in sorted(assets.assets.values(), key=lambda item: item.path):
+        sizes = ", ".join(f"{encoding} {len(body)}" for encoding, body in asset.bodies.items())
+        print(f"{asset.path} -> {asset.url} ({sizes})")
+    if Image is None:
+        print("Pillow is not installed; image variants were skipped.", file=sys.stderr)
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mock_servers import start_site, static_app  # noqa: E402
+
+SOURCE_BUDGET_SECONDS = 2.0
+
+
+async def main() -> None:
+    os.environ.update(WEB_CONTEXT_SOURCE_SECONDS=str(SOURCE_BUDGET_SECONDS), WEB_CONTEXT_BUDGET_SECONDS=str(SOURCE_BUDGET_SECONDS + 1))
+    from ai_service import ResponseStats, build_web_context
+    from http_pool import close_pools, open_pools
+
+    runner, port = await start_site(static_app(pages=2))
+    await open_pools()
+    try:
+        fast = f"http://127.0.0.1:{port}/page/0"
+        slow = f"http://127.0.0.1:{port}/page/1?delay={SOURCE_BUDGET_SECONDS * 2:g}"
+        stats = ResponseStats()
+        context = await build_web_context(f"Compare {fast} with {slow}", stats)
+    finally:
+        await close_pools()
+        await runner.cleanup()
+
+    print(f"url source took {stats.timings.get('url', 0):.2f}s with a {SOURCE_BUDGET_SECONDS:g}s budget")
+    if f"Source: {fast}\n" not in context or "Could not read this page: Timed out" not in context:
+        raise SystemExit(f"fast page was lost when the slow page timed out:\n{context!r}")
+    print("fast page kept, slow page reported as timed out")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import aiohttp
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from mock_servers import FakeDDGS, UpstreamProfile, completion_app, sentence, start_site, static_app  # noqa: E402
+
+OPERATION_WEIGHTS = {"history": 6, "chat": 3, "new": 1}
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed_store(db_path: Path, users: int, chat_length: int) -> None:
+    from storage import SQLiteStorage
+
+    storage = SQLiteStorage(db_path, compact_every=0)
+    rng = random.Random(3)
+    for user_index in range(users):
+        for chat_index in range(3):
+            timestamp = f"2026-01-01T00:{chat_index:02d}:00+00:00"
+            chat = {"id": f"chat_seed_{user_index}_{chat_index}", "title": f"Seeded chat {chat_index}", "created_at": timestamp, "updated_at": timestamp}
+            messages = [
+                json.dumps(
+                    {"role": "user" if position % 2 == 0 else "assistant", "content": sentence(rng, 40), "timestamp": timestamp},
+                    ensure_ascii=False,
+                )
+                for position in range(chat_length)
+            ]
+            storage.save_chat(f"seed_{user_index}", chat, messages)
+    storage.close()
+
+
+def chat_message(rng: random.Random, static_port: int) -> str:
+    kind = rng.random()
+    if kind < 0.15:
+        return f"Summarize http://127.0.0.1:{static_port}/page/{rng.randrange(50)} for me"
+    if kind < 0.3:
+        return f"Search the latest news about {rng.choice(['sqlite', 'asyncio', 'quart'])}"
+    return sentence(rng, 12)
+
+
+async def drive(base_url: str, args: argparse.Namespace, static_port: int) -> dict[str, list[tuple[float, bool]]]:
+    results: dict[str, list[tuple[float, bool]]] = {name: [] for name in OPERATION_WEIGHTS}
+    deadline = perf_counter() + args.duration
+    operations = list(OPERATION_WEIGHTS)
+    weights = list(OPERATION_WEIGHTS.values())
+
+    async def client(index: int, session: aiohttp.ClientSession) -> None:
+        rng = random.Random(index)
+        own_id = f"bench_{index}"
+        while perf_counter() < deadline:
+            user_id = f"seed_{rng.randrange(args.users)}" if args.users and rng.random() < 0.5 else own_id
+            headers = {"X-User-Session-ID": user_id}
+            operation = rng.choices(operations, weights)[0]
+            started_at = perf_counter()
+            try:
+                if operation == "history":
+                    async with session.get(f"{base_url}/api/history", headers=headers) as response:
+                        await response.read()
+                elif operation == "new":
+                    async with session.post(f"{base_url}/api/new", json={}, headers=headers) as response:
+                        await response.read()
+                else:
+                    path = "/api/chat/stream" if args.stream else "/api/chat"
+                    async with session.post(f"{base_url}{path}", json={"message": chat_message(rng, static_port)}, headers=headers) as response:
+                        body = await response.read()
+                ok = response.status < 400 and not (operation == "chat" and args.stream and b"event: error" in body)
+            except (aiohttp.ClientError, TimeoutError):
+                ok = False
+            results[operation].append((perf_counter() - started_at, ok))
+
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as session:
+        await asyncio.gather(*(client(index, session) for index in range(args.concurrency)))
+    return results
+
+
+async def run_scenario(args: argparse.Namespace) -> dict:
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    profile = UpstreamProfile(args.upstream_latency, args.token_delay, args.tokens, args.error_rate)
+    upstream_runner, upstream_port = await start_site(completion_app(profile))
+    static_runner, static_port = await start_site(static_app())
+    FakeDDGS.base_url = f"http://127.0.0.1:{static_port}"
+
+    workdir = Path(tempfile.mkdtemp(prefix="bearcode-bench-"))
+    db_path = workdir / "chat_store.db"
+    started_at = perf_counter()
+    seed_store(db_path, args.users, args.length)
+    seed_seconds = perf_counter() - started_at
+
+    os.environ.update(
+        CHAT_DB_PATH=str(db_path),
+        CHAT_STORE_PATH=str(workdir / "chat_store.json"),
+        OPENROUTER_API_KEY="benchmark",
+        OPENROUTER_API_URL=f"http://127.0.0.1:{upstream_port}/api/v1/chat/completions",
+        OPENROUTER_HEDGE_SECONDS="0",
+        TITLE_DEBOUNCE_SECONDS="1",
+    )
+    import web_scraper
+
+    web_scraper.DDGS = FakeDDGS
+    import app as app_module
+
+    port = free_port()
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.accesslog = None
+    config.errorlog = None
+    shutdown = asyncio.Event()
+    server = asyncio.create_task(serve(app_module.app, config, shutdown_trigger=shutdown.wait))
+    base_url = f"http://127.0.0.1:{port}"
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f"{base_url}/api/health") as response:
+                    if response.status == 200:
+                        break
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.05)
+
+    results = await drive(base_url, args, static_port)
+    shutdown.set()
+    await server
+    await upstream_runner.cleanup()
+    await static_runner.cleanup()
+
+    operations = {}
+    for name, samples in results.items():
+        latencies = [seconds for seconds, _ in samples]
+        operations[name] = {
+            "count": len(samples),
+            "errors": sum(1 for _, ok in samples if not ok),
+            "rps": round(len(samples) / args.duration, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        }
+    return {
+        "users": args.users,
+        "length": args.length,
+        "seed_seconds": round(seed_seconds, 2),
+        "db_bytes": sum(path.stat().st_size for path in workdir.glob("chat_store.db*")),
+        "rps": round(sum(len(samples) for samples in results.values()) / args.duration, 1),
+        "operations": operations,
+    }
+
+
+def print_report(reports: list[dict]) -> None:
+    print(f"{'users':>7} {'length':>6} {'op':<8} {'count':>7} {'errors':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for report in reports:
+        for name, stats in report["operations"].items():
+            print(
+                f"{report['users']:>7} {report['length']:>6} {name:<8} {stats['count']:>7} {stats['errors']:>6} "
+                f"{stats['rps']:>8} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}"
+            )
+        print(f"{report['users']:>7} {report['length']:>6} {'total':<8} {'':>7} {'':>6} {report['rps']:>8}   seeded in {report['seed_seconds']}s, {report['db_bytes']} bytes")
+
+
+def scenario_command(args: argparse.Namespace, users: int, length: int) -> list[str]:
+    return [
+        sys.executable, __file__, "--scenario",
+        "--users", str(users), "--length", str(length),
+        "--concurrency", str(args.concurrency), "--duration", str(args.duration),
+        "--upstream-latency", str(args.upstream_latency), "--token-delay", str(args.token_delay),
+        "--tokens", str(args.tokens), "--error-rate", str(args.error_rate),
+        "--request-timeout", str(args.request_timeout),
+        *(["--stream"] if args.stream else []),
+    ]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load-test the chat app against local mock upstreams.")
+    parser.add_argument("--store-users", default="0,500,2000", help="comma-separated numbers of seeded users")
+    parser.add_argument("--chat-lengths", default="10,100", help="comma-separated messages per seeded chat")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--stream", action="store_true", help="use /api/chat/stream for chat turns")
+    parser.add_argument("--upstream-latency", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="also write the reports to this file")
+    parser.add_argument("--scenario", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--users", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--length", type=int, default=10, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.scenario:
+        print(json.dumps(asyncio.run(run_scenario(args))))
+        return
+
+    reports = []
+    for users in [int(item) for item in args.store_users.split(",") if item.strip()]:
+        for length in [int(item) for item in args.chat_lengths.split(",") if item.strip()]:
+            completed = subprocess.run(scenario_command(args, users, length), capture_output=True, text=True, cwd=ROOT)
+            if completed.returncode != 0:
+                print(completed.stderr, file=sys.stderr)
+                sys.exit(completed.returncode)
+            reports.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    print_report(reports)
+    if args.json:
+        Path(args.json).write_text(json.dumps(reports, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from aiohttp import web
+
+WORDS = (
+    "asyncio latency storage cache sqlite stream socket python quart worker request response context "
+    "search page title model token budget queue history message backend frontend render index"
+).split()
+
+
+@dataclass
+class UpstreamProfile:
+    latency_seconds: float = 0.2
+    token_delay_seconds: float = 0.01
+    tokens: int = 40
+    error_rate: float = 0.0
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def completion_app(profile: UpstreamProfile) -> web.Application:
+    rng = random.Random(7)
+
+    async def completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if rng.random() < profile.error_rate:
+            return web.json_response({"error": {"message": "mock upstream overloaded"}}, status=503)
+
+        system_prompt = str(body.get("messages", [{}])[0].get("content", ""))
+        if "JSON array" in system_prompt:
+            count = str(body["messages"][-1]["content"]).count("Chat ")
+            await asyncio.sleep(profile.latency_seconds)
+            titles = [f"Benchmark topic {index}" for index in range(count)]
+            return web.json_response({"choices": [{"message": {"content": json.dumps(titles)}}]})
+
+        if not body.get("stream"):
+            await asyncio.sleep(profile.latency_seconds + profile.token_delay_seconds * profile.tokens)
+            return web.json_response({"choices": [{"message": {"content": sentence(rng, profile.tokens)}}]})
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(profile.latency_seconds)
+        for _ in range(profile.tokens):
+            chunk = {"choices": [{"delta": {"content": f"{rng.choice(WORDS)} "}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(profile.token_delay_seconds)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    app = web.Application()
+    app.router.add_post("/api/v1/chat/completions", completions)
+    return app
+
+
+def static_app(pages: int = 50, paragraphs: int = 120) -> web.Application:
+    rng = random.Random(11)
+    documents = {}
+    for index in range(pages):
+        nav = "".join(f"<li><a href='/page/{item}'>Section {item}</a></li>" for item in range(40))
+        body = "".join(f"<p>{sentence(rng, 30)}</p>" for _ in range(paragraphs))
+        documents[str(index)] = (
+            f"<html><head><title>Benchmark page {index}</title><meta name='description' content='Static page {index}'></head>"
+            f"<body><nav><ul>{nav}</ul></nav><main><h1>Page {index}</h1>{body}</main><footer>footer</footer></body></html>"
+        )
+
+    async def page(request: web.Request) -> web.Response:
+        document = documents.get(request.match_info["index"])
+        if document is None:
+            raise web.HTTPNotFound()
+        await asyncio.sleep(float(request.query.get("delay", "0")))
+        return web.Response(text=document, content_type="text/html", headers={"Cache-Control": "max-age=60"})
+
+    app = web.Application()
+    app.router.add_get("/page/{index}", page)
+    return app
+
+
+class FakeDDGS:
+    base_url = "http://127.0.0.1"
+    latency_seconds = 0.05
+
+    def text(self, query: str, max_results: int = 5) -> list[dict[str, Any]]:
+        time.sleep(self.latency_seconds)
+        return [
+            {"title": f"{query} result {index}", "href": f"{self.base_url}/page/{index}", "body": f"Snippet {index} about {query}."}
+            for index in range(max_results)
+        ]
+
+
+async def start_site(app: web.Application, port: int = 0) -> tuple[web.AppRunner, int]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
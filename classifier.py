@@ -0,0 +1,95 @@
+import json
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    sre_constants = sre_parse = None
+
+DEFAULT_RULES_PATH = Path(__file__).resolve().parent / "classifier_rules.json"
+CACHE_MAX_CHARS = 512
+
+
+def literal_prefixes(items: Any) -> tuple[set[str], bool]:
+    options = {""}
+    for op, value in items:
+        if op is sre_constants.LITERAL:
+            options = {option + chr(value) for option in options}
+            continue
+        if op is sre_constants.AT:
+            continue
+        if op is sre_constants.SUBPATTERN:
+            branches = [value[-1]]
+        elif op is sre_constants.BRANCH:
+            branches = value[1]
+        else:
+            return options, False
+
+        results = [literal_prefixes(branch) for branch in branches]
+        options = {option + suffix for option in options for suffixes, _ in results for suffix in suffixes}
+        if not all(complete for _, complete in results):
+            return options, False
+    return options, True
+
+
+def required_keywords(patterns: list[str]) -> tuple[str, ...] | None:
+    if sre_parse is None:
+        return None
+
+    keywords: set[str] = set()
+    for pattern in patterns:
+        try:
+            options, _ = literal_prefixes(sre_parse.parse(pattern))
+        except Exception:
+            return None
+        if "" in options:
+            return None
+        keywords.update(options)
+
+    return tuple(sorted(keyword for keyword in keywords if not any(other != keyword and other in keyword for other in keywords)))
+
+
+class IntentClassifier:
+    def __init__(self, rules: dict[str, Any]):
+        categories: dict[str, list[str]] = rules.get("categories", {})
+        self.disallowed = frozenset(rules.get("disallowed", []))
+        self.matchers = {
+            name: (required_keywords(patterns), re.compile("|".join(f"(?:{pattern})" for pattern in patterns)))
+            for name, patterns in categories.items()
+            if patterns
+        }
+        self.patterns = {name: re.compile(pattern, re.IGNORECASE) for name, pattern in rules.get("patterns", {}).items()}
+        self.cached_categories = lru_cache(maxsize=256)(self.match_categories)
+
+    def match_categories(self, text: str) -> frozenset[str]:
+        normalized = " ".join(text.lower().split())
+        return frozenset(
+            name
+            for name, (keywords, matcher) in self.matchers.items()
+            if (keywords is None or any(keyword in normalized for keyword in keywords)) and matcher.search(normalized)
+        )
+
+    def classify(self, text: str) -> frozenset[str]:
+        if len(text) > CACHE_MAX_CHARS:
+            return self.match_categories(text)
+        return self.cached_categories(text)
+
+    def is_disallowed(self, text: str) -> bool:
+        return not self.disallowed.isdisjoint(self.classify(text))
+
+    def strip(self, name: str, text: str) -> str:
+        return self.patterns[name].sub("", text)
+
+
+def load_rules(path: Path) -> dict[str, Any]:
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+@lru_cache(maxsize=1)
+def get_classifier() -> IntentClassifier:
+    path = Path(os.getenv("CLASSIFIER_RULES_PATH") or DEFAULT_RULES_PATH)
+    return IntentClassifier(load_rules(path))
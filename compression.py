@@ -0,0 +1,135 @@
+import os
+import zlib
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASGIApp = Callable[[dict[str, Any], Callable[[], Awaitable[dict[str, Any]]], Callable[[dict[str, Any]], Awaitable[None]]], Awaitable[None]]
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/plain", "text/css", "application/javascript")
+
+
+def accepted_encodings(header: str) -> dict[str, float]:
+    accepted = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(header: str) -> str | None:
+    accepted = accepted_encodings(header)
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            chunk = self.compressor.process(data) if data else b""
+            return chunk + (self.compressor.finish() if final else self.compressor.flush())
+        chunk = self.compressor.compress(data)
+        return chunk + self.compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, min_bytes: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.min_bytes = min_bytes
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable[[], Awaitable[dict[str, Any]]], send: Callable[[dict[str, Any]], Awaitable[None]]) -> None:
+        if scope["type"] != "http" or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = {name.lower(): value for name, value in scope.get("headers", [])}
+        encoding = choose_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        compressor: StreamCompressor | None = None
+        passthrough = False
+
+        async def compressing_send(message: dict[str, Any]) -> None:
+            nonlocal compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                if not self.should_compress(message["status"], headers):
+                    passthrough = True
+                    await send(message)
+                    return
+
+                compressor = StreamCompressor(encoding)
+                await send({**message, "headers": self.compressed_headers(headers, encoding)})
+                return
+
+            if passthrough or compressor is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            more_body = message.get("more_body", False)
+            body = compressor.compress(message.get("body", b""), final=not more_body)
+            if body or not more_body:
+                await send({**message, "body": body})
+
+        await self.app(scope, receive, compressing_send)
+
+    def should_compress(self, status: int, headers: list[tuple[bytes, bytes]]) -> bool:
+        if status < 200 or status in {204, 206, 304}:
+            return False
+
+        values = {name.decode("latin-1").lower(): value.decode("latin-1").lower() for name, value in headers}
+        if "content-encoding" in values or "no-transform" in values.get("cache-control", ""):
+            return False
+        if not values.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+            return False
+        length = values.get("content-length")
+        return length is None or (length.isdigit() and int(length) >= self.min_bytes)
+
+    def compressed_headers(self, headers: list[tuple[bytes, bytes]], encoding: str) -> list[tuple[bytes, bytes]]:
+        updated = []
+        vary = []
+        for name, value in headers:
+            key = name.lower()
+            if key == b"content-length":
+                continue
+            if key == b"vary":
+                vary.append(value)
+                continue
+            if key == b"etag" and not value.startswith(b"W/"):
+                value = b"W/" + value
+            updated.append((name, value))
+
+        if b"accept-encoding" not in b",".join(vary).lower():
+            vary.append(b"Accept-Encoding")
+        updated.append((b"content-encoding", encoding.encode("latin-1")))
+        updated.append((b"vary", b", ".join(vary)))
+        return updated
@@ -0,0 +1,33 @@
+import asyncio
+from typing import Any
+
+
+class EventBroker:
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self.subscribers: dict[str, set[asyncio.Queue]] = {}
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue) -> None:
+        queues = self.subscribers.get(user_id)
+        if not queues:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[user_id]
+
+    def has_subscribers(self, user_id: str) -> bool:
+        return bool(self.subscribers.get(user_id))
+
+    def publish(self, user_id: str, event: str, data: dict[str, Any]) -> None:
+        for queue in self.subscribers.get(user_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self.subscribers.values())
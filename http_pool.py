@@ -0,0 +1,70 @@
+import os
+import ssl
+from dataclasses import dataclass
+
+import aiohttp
+
+SSL_CONTEXT = ssl.create_default_context()
+INSECURE_SSL_CONTEXT = ssl.create_default_context()
+INSECURE_SSL_CONTEXT.check_hostname = False
+INSECURE_SSL_CONTEXT.verify_mode = ssl.CERT_NONE
+
+POOL_PREFIXES = {
+    "upstream": "UPSTREAM",
+    "web": "WEB",
+}
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    limit: int
+    limit_per_host: int
+    keepalive_timeout: float
+    dns_cache_ttl: int
+
+
+def get_pool_config(name: str) -> PoolConfig:
+    prefix = POOL_PREFIXES.get(name, name.upper())
+    return PoolConfig(
+        limit=int(os.getenv(f"{prefix}_POOL_LIMIT", "100")),
+        limit_per_host=int(os.getenv(f"{prefix}_POOL_LIMIT_PER_HOST", "20" if name == "upstream" else "4")),
+        keepalive_timeout=float(os.getenv(f"{prefix}_POOL_KEEPALIVE_SECONDS", "30")),
+        dns_cache_ttl=int(os.getenv(f"{prefix}_POOL_DNS_CACHE_SECONDS", "300")),
+    )
+
+
+_sessions: dict[str, aiohttp.ClientSession] = {}
+
+
+def create_session(name: str) -> aiohttp.ClientSession:
+    config = get_pool_config(name)
+    connector = aiohttp.TCPConnector(
+        limit=config.limit,
+        limit_per_host=config.limit_per_host,
+        keepalive_timeout=config.keepalive_timeout,
+        use_dns_cache=True,
+        ttl_dns_cache=config.dns_cache_ttl,
+        ssl=SSL_CONTEXT,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+def get_session(name: str) -> aiohttp.ClientSession:
+    session = _sessions.get(name)
+    if session is None or session.closed:
+        session = create_session(name)
+        _sessions[name] = session
+    return session
+
+
+async def open_pools() -> None:
+    for name in POOL_PREFIXES:
+        get_session(name)
+
+
+async def close_pools() -> None:
+    sessions = list(_sessions.values())
+    _sessions.clear()
+    for session in sessions:
+        if not session.closed:
+            await session.close()
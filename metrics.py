@@ -0,0 +1,156 @@
+import math
+from abc import ABC, abstractmethod
+from collections.abc import Awaitable, Callable
+from functools import wraps
+from time import perf_counter
+from typing import Any, TypeVar
+
+LabelValues = tuple[str, ...]
+T = TypeVar("T")
+M = TypeVar("M", bound="Metric")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: tuple[str, ...], values: LabelValues, extra: dict[str, str] | None = None) -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{escape_label(value)}"' for name, value in (extra or {}).items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def label_values(self, labels: dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    @abstractmethod
+    def samples(self) -> list[str]: ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: dict[LabelValues, float] = {} if labels else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self.label_values(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}" for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: dict[LabelValues, float] = {}
+        self.function: Callable[[], float | dict[LabelValues, float]] | None = None
+
+    def set(self, value: float, **labels: Any) -> None:
+        self.values[self.label_values(labels)] = value
+
+    def set_function(self, function: Callable[[], float | dict[LabelValues, float]]) -> None:
+        self.function = function
+
+    def samples(self) -> list[str]:
+        values = dict(self.values)
+        if self.function is not None:
+            try:
+                result = self.function()
+            except Exception:
+                result = {}
+            values.update(result if isinstance(result, dict) else {(): result})
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts: dict[LabelValues, list[int]] = {}
+        self.sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self.label_values(labels)
+        counts = self.counts.setdefault(key, [0] * len(self.buckets))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        self.sums[key] = self.sums.get(key, 0.0) + value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, {'le': format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(self.sums[key])}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: M) -> M:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Counter("bearcode_http_requests_total", "HTTP requests handled.", ("method", "route", "status")))
+HTTP_DURATION = registry.register(Histogram("bearcode_http_request_duration_seconds", "Time to build an HTTP response.", ("method", "route")))
+STAGE_DURATION = registry.register(Histogram("bearcode_stage_duration_seconds", "Latency of individual request stages.", ("stage",)))
+UPSTREAM_ERRORS = registry.register(Counter("bearcode_upstream_errors_total", "AI provider errors returned to clients.", ("reason",)))
+UPSTREAM_RETRIES = registry.register(Counter("bearcode_upstream_retries_total", "Upstream completion retries."))
+STORE_SIZE = registry.register(Gauge("bearcode_store_size", "Chat store size.", ("kind",)))
+TITLE_TASKS = registry.register(Gauge("bearcode_title_tasks", "Background title refreshes.", ("state",)))
+UPSTREAM_REQUESTS = registry.register(Gauge("bearcode_upstream_requests", "Upstream completions holding or waiting for a slot.", ("state",)))
+
+
+def observe_stage(stage: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    def decorate(function: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @wraps(function)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            started_at = perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                STAGE_DURATION.observe(perf_counter() - started_at, stage=stage)
+
+        return wrapper
+
+    return decorate
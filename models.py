@@ -0,0 +1,86 @@
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Literal
+
+Role = Literal["assistant", "user"]
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class RawJSON(str):
+    pass
+
+
+def encode_json(value: Any) -> str:
+    if isinstance(value, RawJSON):
+        return value
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{json.dumps(str(key), ensure_ascii=False)}:{encode_json(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, list):
+        return "[" + ",".join(encode_json(item) for item in value) + "]"
+    return json.dumps(value, ensure_ascii=False)
+
+
+@dataclass(slots=True)
+class Message:
+    role: Role
+    content: str
+    timestamp: str
+    elapsed_seconds: float | None = None
+    first_token_seconds: float | None = None
+    model: str | None = None
+    cached_json: RawJSON | None = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        if name != "cached_json":
+            object.__setattr__(self, "cached_json", None)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "role": self.role,
+            "content": self.content,
+            "timestamp": self.timestamp,
+            "elapsed_seconds": self.elapsed_seconds,
+            "first_token_seconds": self.first_token_seconds,
+            "model": self.model,
+        }
+
+    def to_json(self) -> RawJSON:
+        if self.cached_json is None:
+            self.cached_json = RawJSON(json.dumps(self.to_dict(), ensure_ascii=False))
+        return self.cached_json
+
+
+@dataclass(slots=True)
+class Chat:
+    id: str
+    title: str
+    messages: list[Message] = field(default_factory=list)
+    created_at: str = field(default_factory=now_iso)
+    updated_at: str = field(default_factory=now_iso)
+    cached_json: RawJSON | None = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        if name != "cached_json":
+            object.__setattr__(self, "cached_json", None)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "title": self.title,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    def to_json(self, include_messages: bool = False, start: int = 0) -> RawJSON:
+        if self.cached_json is None:
+            self.cached_json = RawJSON(json.dumps(self.to_dict(), ensure_ascii=False))
+        if not include_messages:
+            return self.cached_json
+        messages = ",".join(message.to_json() for message in self.messages[start:])
+        return RawJSON(f'{self.cached_json[:-1]},"messages":[{messages}]}}')
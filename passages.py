@@ -0,0 +1,95 @@
+import math
+import re
+from collections import Counter
+
+CONTENT_MARKER = "\nCONTENT:\n"
+PASSAGE_GAP = "\n[…]\n"
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) > 1 or token.isdigit()]
+
+
+def split_passages(text: str, target_chars: int = 600) -> list[str]:
+    passages: list[str] = []
+    current: list[str] = []
+    size = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if current and size + len(line) > target_chars:
+            passages.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+
+def bm25_scores(query_terms: list[str], passages: list[list[str]], k1: float = 1.5, b: float = 0.75) -> list[float]:
+    if not passages:
+        return []
+
+    average_length = sum(len(terms) for terms in passages) / len(passages) or 1.0
+    document_frequency = Counter(term for terms in passages for term in set(terms))
+    unique_query = set(query_terms)
+    scores = []
+    for terms in passages:
+        frequencies = Counter(terms)
+        length_norm = k1 * (1 - b + b * len(terms) / average_length)
+        score = 0.0
+        for term in unique_query:
+            frequency = frequencies.get(term)
+            if not frequency:
+                continue
+            idf = math.log(1 + (len(passages) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + length_norm)
+        scores.append(score)
+    return scores
+
+
+def select_passages(text: str, query: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+
+    header, marker, body = text.partition(CONTENT_MARKER)
+    if not marker:
+        header, body = "", text
+    header = header + marker
+    budget = max_chars - len(header)
+    passages = split_passages(body)
+    query_terms = tokenize(query)
+    if budget <= 0 or not passages:
+        return text[:max_chars]
+
+    scores = bm25_scores(query_terms, [tokenize(passage) for passage in passages]) if query_terms else [0.0] * len(passages)
+    if not any(scores):
+        ranked = list(range(len(passages)))
+    else:
+        ranked = sorted((index for index, score in enumerate(scores) if score > 0), key=lambda index: (-scores[index], index))
+
+    selected: list[int] = []
+    used = 0
+    for index in ranked:
+        cost = len(passages[index]) + len(PASSAGE_GAP)
+        if used + cost > budget:
+            if not any(scores):
+                break
+            continue
+        selected.append(index)
+        used += cost
+
+    if not selected:
+        return header + passages[ranked[0]][:budget]
+
+    parts: list[str] = []
+    previous = -1
+    for index in sorted(selected):
+        if parts and index != previous + 1:
+            parts.append(PASSAGE_GAP.strip("\n"))
+        parts.append(passages[index])
+        previous = index
+    return header + "\n".join(parts)
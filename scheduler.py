@@ -0,0 +1,194 @@
+import asyncio
+import os
+import random
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic
+from typing import Any
+
+from tracing import span
+
+PRIORITY_CHAT = 0
+PRIORITY_TITLE = 1
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class SchedulerConfig:
+    max_concurrency: int
+    breaker_failures: int
+    breaker_cooldown_seconds: float
+    backoff_base_seconds: float
+    backoff_max_seconds: float
+
+
+def get_scheduler_config() -> SchedulerConfig:
+    return SchedulerConfig(
+        max_concurrency=max(int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "8")), 1),
+        breaker_failures=max(int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5")), 1),
+        breaker_cooldown_seconds=float(os.getenv("UPSTREAM_BREAKER_COOLDOWN_SECONDS", "30")),
+        backoff_base_seconds=float(os.getenv("UPSTREAM_BACKOFF_BASE_SECONDS", "0.5")),
+        backoff_max_seconds=float(os.getenv("UPSTREAM_BACKOFF_MAX_SECONDS", "8")),
+    )
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def backoff_delay(attempt: int, retry_after: float | None, config: SchedulerConfig) -> float | None:
+    if retry_after is not None:
+        return retry_after if retry_after <= config.backoff_max_seconds else None
+    return random.uniform(0, min(config.backoff_max_seconds, config.backoff_base_seconds * 2**attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if monotonic() - self.opened_at < self.cooldown_seconds:
+            return "open"
+        return "half_open"
+
+    def check(self) -> None:
+        if self.state == "open":
+            raise CircuitOpenError("Upstream circuit is open")
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.opened_at = monotonic()
+
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(self.cooldown_seconds - (monotonic() - self.opened_at), 0.0)
+
+
+class UpstreamScheduler:
+    def __init__(self, config: SchedulerConfig):
+        self.config = config
+        self.breaker = CircuitBreaker(config.breaker_failures, config.breaker_cooldown_seconds)
+        self.in_flight = 0
+        self.queues: dict[int, OrderedDict[str, deque[asyncio.Future]]] = {}
+        self.retries = 0
+
+    def queued(self) -> int:
+        return sum(len(waiters) for users in self.queues.values() for waiters in users.values())
+
+    async def acquire(self, user_id: str, priority: int) -> None:
+        self.breaker.check()
+        if self.in_flight < self.config.max_concurrency and not self.queued():
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(priority, OrderedDict()).setdefault(user_id, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self.discard(user_id, priority, waiter)
+            raise
+
+    def discard(self, user_id: str, priority: int, waiter: asyncio.Future) -> None:
+        users = self.queues.get(priority)
+        waiters = users.get(user_id) if users else None
+        if not waiters:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            return
+        if not waiters:
+            del users[user_id]
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        while self.in_flight < self.config.max_concurrency:
+            waiter = self.next_waiter()
+            if waiter is None:
+                return
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def next_waiter(self) -> asyncio.Future | None:
+        for priority in sorted(self.queues):
+            users = self.queues[priority]
+            if not users:
+                continue
+            user_id, waiters = users.popitem(last=False)
+            waiter = waiters.popleft()
+            if waiters:
+                users[user_id] = waiters
+            return waiter
+        return None
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, priority: int = PRIORITY_CHAT) -> AsyncIterator[None]:
+        with span("upstream.queue", priority=priority, in_flight=self.in_flight):
+            await self.acquire(user_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued(),
+            "max_concurrency": self.config.max_concurrency,
+            "retries": self.retries,
+            "circuit": self.breaker.state,
+            "circuit_trips": self.breaker.trips,
+        }
+
+
+_scheduler: UpstreamScheduler | None = None
+
+
+def get_scheduler() -> UpstreamScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = UpstreamScheduler(get_scheduler_config())
+    return _scheduler
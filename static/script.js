@@ -5,6 +5,10 @@ const state = {
     sessionId: getSessionId(),
     isSending: false,
     abortController: null,
+    messageCount: 0,
+    lastTimestamp: null,
+    chatsVersion: null,
+    animatingTitle: null,
 };
 
 const elements = {
@@ -59,7 +63,7 @@ function formatMessage(content) {
     return DOMPurify.sanitize(marked.parse(content));
 }
 
-function messageNode(role, content, elapsedSeconds) {
+function messageNode(role, content, elapsedSeconds, firstTokenSeconds) {
     const message = document.createElement("article");
     message.className = `message ${role}`;
 
@@ -72,24 +76,26 @@ function messageNode(role, content, elapsedSeconds) {
     bubble.innerHTML = formatMessage(content);
 
     if (role === "assistant" && Number.isFinite(elapsedSeconds)) {
-        bubble.appendChild(responseTimeNode(elapsedSeconds));
+        bubble.appendChild(responseTimeNode(elapsedSeconds, firstTokenSeconds));
     }
 
     message.append(avatar, bubble);
     return message;
 }
 
-function addMessage(role, content, elapsedSeconds) {
-    const node = messageNode(role, content, elapsedSeconds);
+function addMessage(role, content, elapsedSeconds, firstTokenSeconds) {
+    const node = messageNode(role, content, elapsedSeconds, firstTokenSeconds);
     elements.typing.before(node);
     scrollToBottom();
     return node;
 }
 
-function responseTimeNode(elapsedSeconds) {
+function responseTimeNode(elapsedSeconds, firstTokenSeconds) {
     const node = document.createElement("small");
     node.className = "response-time";
-    node.textContent = `Completed in ${formatDuration(elapsedSeconds)}`;
+    node.textContent = Number.isFinite(firstTokenSeconds)
+        ? `First token in ${formatDuration(firstTokenSeconds)} · Completed in ${formatDuration(elapsedSeconds)}`
+        : `Completed in ${formatDuration(elapsedSeconds)}`;
     return node;
 }
 
@@ -101,30 +107,75 @@ function formatDuration(value) {
     return `${value.toFixed(value < 10 ? 1 : 0)}s`;
 }
 
-async function addTypedMessage(content, elapsedSeconds) {
+function addStreamingMessage() {
     const node = messageNode("assistant", "");
     const bubble = node.querySelector(".bubble");
     elements.typing.before(node);
     bubble.classList.add("typing-output");
+    let content = "";
 
-    let current = "";
-    const characters = Array.from(content);
-    const chunkSize = content.length > 2400 ? 24 : content.length > 900 ? 14 : 7;
+    return {
+        append(delta) {
+            content += delta;
+            bubble.textContent = content;
+            scrollToBottom();
+        },
+        finish(finalContent, elapsedSeconds, firstTokenSeconds) {
+            bubble.classList.remove("typing-output");
+            bubble.innerHTML = formatMessage(finalContent ?? content);
+            if (Number.isFinite(elapsedSeconds)) {
+                bubble.appendChild(responseTimeNode(elapsedSeconds, firstTokenSeconds));
+            }
+            scrollToBottom();
+        },
+        remove() {
+            node.remove();
+        },
+    };
+}
+
+function parseServerEvent(raw) {
+    let name = "message";
+    const dataLines = [];
 
-    for (let index = 0; index < characters.length; index += chunkSize) {
-        current += characters.slice(index, index + chunkSize).join("");
-        bubble.textContent = current;
-        scrollToBottom();
-        await wait(16);
+    for (const line of raw.split("\n")) {
+        if (line.startsWith("event:")) {
+            name = line.slice(6).trim();
+        } else if (line.startsWith("data:")) {
+            dataLines.push(line.slice(5).trimStart());
+        }
     }
 
-    bubble.classList.remove("typing-output");
-    bubble.innerHTML = formatMessage(content);
-    if (Number.isFinite(elapsedSeconds)) {
-        bubble.appendChild(responseTimeNode(elapsedSeconds));
+    if (dataLines.length === 0) {
+        return null;
+    }
+
+    return { name, data: JSON.parse(dataLines.join("\n")) };
+}
+
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+
+        buffer += decoder.decode(value, { stream: true }).replace(/\r\n/g, "\n");
+        let boundary = buffer.indexOf("\n\n");
+
+        while (boundary !== -1) {
+            const event = parseServerEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            if (event) {
+                onEvent(event.name, event.data);
+            }
+            boundary = buffer.indexOf("\n\n");
+        }
     }
-    scrollToBottom();
-    return node;
 }
 
 function wait(ms) {
@@ -167,6 +218,37 @@ function resizeInput() {
     elements.input.style.overflowY = elements.input.scrollHeight > 180 ? "auto" : "hidden";
 }
 
+function syncCursor(chat, offset) {
+    const messages = chat.messages || [];
+    state.messageCount = (offset || 0) + messages.length;
+
+    if (messages.length > 0) {
+        state.lastTimestamp = messages[messages.length - 1].timestamp;
+    }
+}
+
+function renderChatMessages(chat, offset) {
+    if (!offset) {
+        clearMessages();
+    }
+
+    for (const item of chat.messages || []) {
+        addMessage(item.role, item.content, item.elapsed_seconds, item.first_token_seconds);
+    }
+
+    syncCursor(chat, offset);
+}
+
+function applyChats(data) {
+    if (data.chats) {
+        renderChats(data.chats);
+    }
+
+    if (data.chats_version) {
+        state.chatsVersion = data.chats_version;
+    }
+}
+
 function renderChats(chats) {
     elements.chatList.replaceChildren();
 
@@ -222,88 +304,80 @@ async function loadChats() {
         }
 
         state.chatId = state.chatId || data.active_chat_id;
-        renderChats(data.chats);
+        applyChats(data);
     } catch {
         showError("Could not load your chats.");
     }
 }
 
-async function refreshChatMetadata() {
-    try {
-        const response = await fetch("/api/chats", { headers: headers() });
-        const data = await response.json();
+function subscribeToChatEvents() {
+    if (!window.EventSource) {
+        return;
+    }
 
-        if (!response.ok) {
-            return;
-        }
+    const source = new EventSource(`/api/events?session_id=${encodeURIComponent(state.sessionId)}`);
 
-        renderChats(data.chats);
+    source.addEventListener("chats", (event) => {
+        const data = JSON.parse(event.data);
+        applyChats(data);
         const activeChat = (data.chats || []).find((chat) => chat.id === state.chatId);
-        if (activeChat) {
+        if (activeChat && !state.isSending) {
             animateTitle(activeChat.title || "New conversation");
         }
-    } catch {
-    }
-}
-
-async function pollChatMetadata(previousTitle) {
-    for (let attempt = 0; attempt < 10; attempt += 1) {
-        await wait(900);
-
-        try {
-            const response = await fetch("/api/chats", { headers: headers() });
-            const data = await response.json();
-
-            if (!response.ok) {
-                continue;
-            }
-
-            renderChats(data.chats);
-            const activeChat = (data.chats || []).find((chat) => chat.id === state.chatId);
-            const nextTitle = activeChat?.title || "New conversation";
+    });
 
-            if (activeChat && nextTitle !== previousTitle) {
-                animateTitle(nextTitle);
-                return;
-            }
-        } catch {
+    source.addEventListener("title", (event) => {
+        const data = JSON.parse(event.data);
+        if (data.chat_id === state.chatId) {
+            animateTitle(data.title || "New conversation");
         }
-    }
+    });
 }
 
 async function animateTitle(title) {
-    if (!title || elements.chatTitle.textContent === title) {
+    if (!title || elements.chatTitle.textContent === title || state.animatingTitle === title) {
         return;
     }
 
+    state.animatingTitle = title;
     elements.chatTitle.textContent = "";
     const characters = Array.from(title);
 
     for (let index = 0; index < characters.length; index += 1) {
+        if (state.animatingTitle !== title) {
+            return;
+        }
         elements.chatTitle.textContent += characters[index];
         await wait(24);
     }
+
+    state.animatingTitle = null;
 }
 
 async function loadHistory(chatId) {
     try {
-        const url = chatId ? `/api/history?chat_id=${encodeURIComponent(chatId)}` : "/api/history";
-        const response = await fetch(url, { headers: headers() });
+        const params = new URLSearchParams();
+        if (chatId) {
+            params.set("chat_id", chatId);
+        }
+        if (chatId && chatId === state.chatId && state.messageCount > 0 && state.lastTimestamp) {
+            params.set("since", String(state.messageCount));
+            params.set("anchor", state.lastTimestamp);
+        }
+
+        const query = params.toString();
+        const response = await fetch(query ? `/api/history?${query}` : "/api/history", { headers: headers() });
         const data = await response.json();
 
         if (!response.ok) {
             throw new Error(data.error);
         }
 
+        const offset = data.chat.id === state.chatId ? data.offset : 0;
         state.chatId = data.chat.id;
         elements.chatTitle.textContent = data.chat.title || "New conversation";
-        clearMessages();
-
-        for (const item of data.chat.messages || []) {
-            addMessage(item.role, item.content, item.elapsed_seconds);
-        }
-
-        renderChats(data.chats);
+        renderChatMessages(data.chat, offset);
+        applyChats(data);
     } catch {
         showError("Could not load this conversation.");
     }
@@ -313,33 +387,67 @@ async function sendMessage(message) {
     setSending(true);
     setTyping(true);
     state.abortController = new AbortController();
+    let output = null;
 
     try {
-        const response = await fetch("/api/chat", {
+        const response = await fetch("/api/chat/stream", {
             method: "POST",
             headers: headers(),
             signal: state.abortController.signal,
             body: JSON.stringify({
                 chat_id: state.chatId,
                 message,
+                since: state.messageCount,
+                anchor: state.lastTimestamp,
+                chats_version: state.chatsVersion,
             }),
         });
 
-        const data = await response.json();
-
         if (!response.ok) {
+            const data = await response.json().catch(() => ({}));
             throw new Error(data.error || "bearCode could not answer right now.");
         }
 
+        let result = null;
+        let streamError = null;
+
+        await readEventStream(response, (name, data) => {
+            if (name === "delta") {
+                if (!output) {
+                    setTyping(false);
+                    output = addStreamingMessage();
+                }
+                output.append(data.content || "");
+            } else if (name === "done") {
+                result = data;
+            } else if (name === "error") {
+                streamError = data.error;
+            }
+        });
+
+        if (!result) {
+            throw new Error(streamError || "bearCode could not answer right now.");
+        }
+
         setTyping(false);
-        const previousTitle = elements.chatTitle.textContent;
-        await addTypedMessage(data.response, data.elapsed_seconds);
-        state.chatId = data.chat.id;
-        animateTitle(data.chat.title || "New conversation");
-        renderChats(data.chats);
-        pollChatMetadata(previousTitle);
+        state.chatId = result.chat.id;
+        if (result.offset) {
+            if (!output) {
+                output = addStreamingMessage();
+            }
+            output.finish(result.response, result.elapsed_seconds, result.first_token_seconds);
+            syncCursor(result.chat, result.offset);
+        } else {
+            renderChatMessages(result.chat, 0);
+        }
+        output = null;
+        animateTitle(result.chat.title || "New conversation");
+        applyChats(result);
     } catch (error) {
         setTyping(false);
+        if (output) {
+            output.remove();
+        }
 
         if (error.name !== "AbortError") {
             showError(error.message);
@@ -366,11 +474,8 @@ async function clearChat() {
 
         state.chatId = data.chat.id;
         elements.chatTitle.textContent = data.chat.title || "New conversation";
-        clearMessages();
-        for (const item of data.chat.messages || []) {
-            addMessage(item.role, item.content, item.elapsed_seconds);
-        }
-        renderChats(data.chats);
+        renderChatMessages(data.chat, 0);
+        applyChats(data);
     } catch (error) {
         showError(error.message);
     }
@@ -390,11 +495,8 @@ async function newChat() {
 
         state.chatId = data.chat.id;
         elements.chatTitle.textContent = data.chat.title || "New conversation";
-        clearMessages();
-        for (const item of data.chat.messages || []) {
-            addMessage(item.role, item.content, item.elapsed_seconds);
-        }
-        renderChats(data.chats);
+        renderChatMessages(data.chat, 0);
+        applyChats(data);
     } catch (error) {
         showError(error.message);
     }
@@ -432,5 +534,6 @@ elements.clearChat.addEventListener("click", clearChat);
 elements.newChat.addEventListener("click", newChat);
 
 loadChats().then(() => loadHistory(state.chatId));
+subscribeToChatEvents();
 resizeInput();
 elements.input.focus();
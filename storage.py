@@ -0,0 +1,534 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from time import monotonic
+from typing import Any
+
+from metrics import STAGE_DURATION
+from tracing import background_trace, span
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    user_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, chat_id, position)
+);
+CREATE TABLE IF NOT EXISTS user_versions (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+class StaleWriteError(Exception):
+    pass
+
+
+class ChatStorage(ABC):
+    @abstractmethod
+    def user_ids(self) -> list[str]: ...
+
+    @abstractmethod
+    def load_user(self, user_id: str) -> list[dict[str, Any]]: ...
+
+    @abstractmethod
+    def message_count(self, user_id: str, chat_id: str) -> int: ...
+
+    @abstractmethod
+    def save_chat(self, user_id: str, chat: dict[str, Any], messages: list[str], start: int = 0) -> None: ...
+
+    @abstractmethod
+    def delete_chats(self, user_id: str, chat_ids: list[str]) -> None: ...
+
+    def stale_users(self, user_ids: list[str]) -> set[str]:
+        return set()
+
+    def compact(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def write_json_atomic(path: Path, data: dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with temp_path.open("w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def read_json_store(path: Path) -> dict[str, list[dict[str, Any]]]:
+    if not path.exists():
+        return {}
+
+    try:
+        raw = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+    return raw if isinstance(raw, dict) else {}
+
+
+class JSONFileStorage(ChatStorage):
+    def __init__(self, path: Path):
+        self.path = path
+        self.data = read_json_store(path)
+        self.lock = threading.Lock()
+
+    def user_ids(self) -> list[str]:
+        return list(self.data)
+
+    def load_user(self, user_id: str) -> list[dict[str, Any]]:
+        chats = self.data.get(user_id)
+        return chats if isinstance(chats, list) else []
+
+    def find_chat(self, user_id: str, chat_id: str) -> dict[str, Any] | None:
+        for item in self.data.get(user_id, []):
+            if isinstance(item, dict) and item.get("id") == chat_id:
+                return item
+        return None
+
+    def message_count(self, user_id: str, chat_id: str) -> int:
+        item = self.find_chat(user_id, chat_id)
+        return len(item.get("messages") or []) if item else 0
+
+    def save_chat(self, user_id: str, chat: dict[str, Any], messages: list[str], start: int = 0) -> None:
+        with self.lock:
+            item = self.find_chat(user_id, chat["id"])
+            if item is None:
+                item = {**chat, "messages": []}
+                self.data.setdefault(user_id, []).append(item)
+
+            item.update(chat)
+            item["messages"] = list(item.get("messages") or [])[:start] + [json.loads(message) for message in messages]
+            write_json_atomic(self.path, self.data)
+
+    def delete_chats(self, user_id: str, chat_ids: list[str]) -> None:
+        with self.lock:
+            removed = set(chat_ids)
+            self.data[user_id] = [item for item in self.data.get(user_id, []) if item.get("id") not in removed]
+            write_json_atomic(self.path, self.data)
+
+
+class SQLiteStorage(ChatStorage):
+    def __init__(self, path: Path, compact_every: int = 500):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.compact_every = compact_every
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.message_counts: dict[tuple[str, str], int] = {}
+        self.synced_versions: dict[str, int] = {}
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM chats LIMIT 1").fetchone() is None
+
+    def load(self) -> dict[str, list[dict[str, Any]]]:
+        data: dict[str, list[dict[str, Any]]] = {}
+        chats: dict[tuple[str, str], dict[str, Any]] = {}
+
+        with self.lock:
+            rows = self.connection.execute("SELECT user_id, id, title, created_at, updated_at FROM chats").fetchall()
+            for user_id, chat_id, title, created_at, updated_at in rows:
+                item = {"id": chat_id, "title": title, "created_at": created_at, "updated_at": updated_at, "messages": []}
+                chats[(user_id, chat_id)] = item
+                data.setdefault(user_id, []).append(item)
+
+            rows = self.connection.execute("SELECT user_id, chat_id, data FROM messages ORDER BY user_id, chat_id, position").fetchall()
+
+        for user_id, chat_id, raw in rows:
+            item = chats.get((user_id, chat_id))
+            if item is None:
+                continue
+            try:
+                item["messages"].append(json.loads(raw))
+            except json.JSONDecodeError:
+                continue
+
+        for (user_id, chat_id), item in chats.items():
+            self.message_counts[(user_id, chat_id)] = len(item["messages"])
+
+        return data
+
+    def user_ids(self) -> list[str]:
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT DISTINCT user_id FROM chats").fetchall()]
+
+    def load_user(self, user_id: str) -> list[dict[str, Any]]:
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                chat_rows = self.connection.execute(
+                    "SELECT id, title, created_at, updated_at FROM chats WHERE user_id = ?",
+                    (user_id,),
+                ).fetchall()
+                message_rows = self.connection.execute(
+                    "SELECT chat_id, data FROM messages WHERE user_id = ? ORDER BY chat_id, position",
+                    (user_id,),
+                ).fetchall()
+                self.synced_versions[user_id] = self.user_version(user_id)
+            finally:
+                self.connection.execute("COMMIT")
+
+        chats = {
+            chat_id: {"id": chat_id, "title": title, "created_at": created_at, "updated_at": updated_at, "messages": []}
+            for chat_id, title, created_at, updated_at in chat_rows
+        }
+        for chat_id, raw in message_rows:
+            item = chats.get(chat_id)
+            if item is None:
+                continue
+            try:
+                item["messages"].append(json.loads(raw))
+            except json.JSONDecodeError:
+                continue
+
+        for chat_id, item in chats.items():
+            self.message_counts[(user_id, chat_id)] = len(item["messages"])
+
+        return list(chats.values())
+
+    def message_count(self, user_id: str, chat_id: str) -> int:
+        key = (user_id, chat_id)
+        if key not in self.message_counts:
+            with self.lock:
+                row = self.connection.execute(
+                    "SELECT COUNT(*) FROM messages WHERE user_id = ? AND chat_id = ?",
+                    key,
+                ).fetchone()
+            self.message_counts[key] = row[0]
+        return self.message_counts[key]
+
+    def save_chat(self, user_id: str, chat: dict[str, Any], messages: list[str], start: int = 0) -> None:
+        rows = [
+            (user_id, chat["id"], position, message)
+            for position, message in enumerate(messages, start=start)
+        ]
+
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.check_version(user_id)
+                self.connection.execute(
+                    "INSERT INTO chats (user_id, id, title, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (user_id, id) DO UPDATE SET title = excluded.title, updated_at = excluded.updated_at",
+                    (user_id, chat["id"], chat["title"], chat["created_at"], chat["updated_at"]),
+                )
+                self.connection.execute(
+                    "DELETE FROM messages WHERE user_id = ? AND chat_id = ? AND position >= ?",
+                    (user_id, chat["id"], start),
+                )
+                self.connection.executemany("INSERT INTO messages (user_id, chat_id, position, data) VALUES (?, ?, ?, ?)", rows)
+                self.bump_version(user_id)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                self.message_counts.pop((user_id, chat["id"]), None)
+                raise
+
+            self.message_counts[(user_id, chat["id"])] = start + len(messages)
+            self.writes += 1
+
+        if self.compact_every and self.writes % self.compact_every == 0:
+            self.compact()
+
+    def delete_chats(self, user_id: str, chat_ids: list[str]) -> None:
+        if not chat_ids:
+            return
+
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.check_version(user_id)
+                for chat_id in chat_ids:
+                    self.connection.execute("DELETE FROM chats WHERE user_id = ? AND id = ?", (user_id, chat_id))
+                    self.connection.execute("DELETE FROM messages WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
+                    self.message_counts.pop((user_id, chat_id), None)
+                self.bump_version(user_id)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def user_version(self, user_id: str) -> int:
+        row = self.connection.execute("SELECT version FROM user_versions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def check_version(self, user_id: str) -> None:
+        if self.user_version(user_id) != self.synced_versions.get(user_id, 0):
+            raise StaleWriteError(f"Chats for {user_id} were changed by another worker")
+
+    def bump_version(self, user_id: str) -> None:
+        version = self.user_version(user_id) + 1
+        self.connection.execute(
+            "INSERT INTO user_versions (user_id, version) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET version = excluded.version",
+            (user_id, version),
+        )
+        self.synced_versions[user_id] = version
+
+    def stale_users(self, user_ids: list[str], chunk_size: int = 500) -> set[str]:
+        stale = set()
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start : start + chunk_size]
+            with self.lock:
+                rows = self.connection.execute(
+                    f"SELECT user_id, version FROM user_versions WHERE user_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            versions = dict(rows)
+            stale.update(user_id for user_id in chunk if self.synced_versions.get(user_id, 0) != versions.get(user_id, 0))
+        return stale
+
+    def compact(self) -> None:
+        with self.lock:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.connection.execute("PRAGMA incremental_vacuum")
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.connection.close()
+
+    def import_json(self, path: Path) -> int:
+        imported = 0
+        for user_id, chats in read_json_store(path).items():
+            if not isinstance(chats, list):
+                continue
+            for item in chats:
+                if not isinstance(item, dict) or not item.get("id"):
+                    continue
+                chat = {
+                    "id": str(item["id"]),
+                    "title": str(item.get("title") or "New conversation"),
+                    "created_at": str(item.get("created_at") or ""),
+                    "updated_at": str(item.get("updated_at") or ""),
+                }
+                messages = [json.dumps(message, ensure_ascii=False) for message in item.get("messages") or [] if isinstance(message, dict)]
+                self.save_chat(user_id, chat, messages)
+                imported += 1
+        return imported
+
+    def export_json(self, path: Path) -> None:
+        write_json_atomic(path, self.load())
+
+
+ChatSnapshot = tuple[dict[str, Any], list[str], int]
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        storage: ChatStorage,
+        snapshot: Callable[[str, str, int], ChatSnapshot | None],
+        rebase: Callable[[str, dict[str, int], set[str]], Awaitable[None]],
+        debounce_seconds: float = 1.0,
+        max_pending: int = 50,
+    ):
+        self.storage = storage
+        self.snapshot = snapshot
+        self.rebase = rebase
+        self.debounce_seconds = debounce_seconds
+        self.max_pending = max_pending
+        self.pending: dict[tuple[str, str], bool] = {}
+        self.deleted: dict[str, set[str]] = {}
+        self.flushing: set[str] = set()
+        self.dirty_since: float | None = None
+        self.last_flush_seconds = 0.0
+        self.flushes = 0
+        self.failures = 0
+        self.conflicts = 0
+        self.wake = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.wake = asyncio.Event()
+            self.full = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+            if self.pending or self.deleted:
+                self.wake.set()
+
+    def mark_chat(self, user_id: str, chat_id: str, replace_messages: bool = False) -> None:
+        key = (user_id, chat_id)
+        self.pending[key] = self.pending.get(key, False) or replace_messages
+        self.notify()
+
+    def mark_deleted(self, user_id: str, chat_ids: list[str]) -> None:
+        if not chat_ids:
+            return
+        self.deleted.setdefault(user_id, set()).update(chat_ids)
+        for chat_id in chat_ids:
+            self.pending.pop((user_id, chat_id), None)
+        self.notify()
+
+    def is_dirty(self, user_id: str) -> bool:
+        return user_id in self.deleted or user_id in self.flushing or any(key[0] == user_id for key in self.pending)
+
+    def notify(self) -> None:
+        if self.dirty_since is None:
+            self.dirty_since = monotonic()
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        self.start()
+        self.wake.set()
+        if len(self.pending) >= self.max_pending:
+            self.full.set()
+
+    async def run(self) -> None:
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            if len(self.pending) < self.max_pending:
+                try:
+                    await asyncio.wait_for(self.full.wait(), timeout=self.debounce_seconds)
+                except TimeoutError:
+                    pass
+            self.full.clear()
+            if not self.pending and not self.deleted:
+                continue
+            with background_trace("store.flush"):
+                await self.flush()
+
+    async def flush(self) -> None:
+        if not self.pending and not self.deleted:
+            return
+
+        pending, self.pending = self.pending, {}
+        deleted, self.deleted = self.deleted, {}
+        dirty_since, self.dirty_since = self.dirty_since, None
+
+        self.flushing = {user_id for user_id, _ in pending} | set(deleted)
+        started_at = monotonic()
+        try:
+            starts = await asyncio.to_thread(self.message_counts, [key for key, replace_messages in pending.items() if not replace_messages])
+            writes = []
+            for user_id, chat_id in pending:
+                snapshot = self.snapshot(user_id, chat_id, starts.get((user_id, chat_id), 0))
+                if snapshot is not None:
+                    writes.append((user_id, *snapshot))
+
+            with span("store.write", chats=len(writes), deleted=sum(len(chat_ids) for chat_ids in deleted.values())):
+                conflicts = await asyncio.to_thread(self.write_batch, writes, deleted)
+            for user_id, (chat_ids, deleted_ids) in conflicts.items():
+                self.conflicts += 1
+                starts = {chat["id"]: start for item_user_id, chat, _, start in writes if item_user_id == user_id and chat["id"] in chat_ids}
+                await self.rebase(user_id, starts, deleted_ids)
+        except Exception as exc:
+            print(f"Chat store flush failed: {exc}")
+            self.failures += 1
+            for key, replace_messages in pending.items():
+                self.pending[key] = self.pending.get(key, False) or replace_messages
+            for user_id, chat_ids in deleted.items():
+                self.deleted.setdefault(user_id, set()).update(chat_ids)
+            if dirty_since is not None:
+                self.dirty_since = min(dirty_since, self.dirty_since or dirty_since)
+            return
+        finally:
+            self.flushing = set()
+
+        self.flushes += 1
+        self.last_flush_seconds = monotonic() - started_at
+        STAGE_DURATION.observe(self.last_flush_seconds, stage="persistence")
+
+    def message_counts(self, keys: list[tuple[str, str]]) -> dict[tuple[str, str], int]:
+        return {key: self.storage.message_count(*key) for key in keys}
+
+    def write_batch(
+        self,
+        writes: list[tuple[str, dict[str, Any], list[str], int]],
+        deleted: dict[str, set[str]],
+    ) -> dict[str, tuple[set[str], set[str]]]:
+        conflicts: dict[str, tuple[set[str], set[str]]] = {}
+        for user_id, chat_ids in deleted.items():
+            try:
+                self.storage.delete_chats(user_id, sorted(chat_ids))
+            except StaleWriteError:
+                conflicts[user_id] = (set(), chat_ids)
+        for user_id, chat, messages, start in writes:
+            if user_id not in conflicts:
+                try:
+                    self.storage.save_chat(user_id, chat, messages, start=start)
+                    continue
+                except StaleWriteError:
+                    conflicts[user_id] = (set(), set())
+            conflicts[user_id][0].add(chat["id"])
+        return conflicts
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending_chats": len(self.pending),
+            "pending_deletes": sum(len(chat_ids) for chat_ids in self.deleted.values()),
+            "lag_seconds": round(monotonic() - self.dirty_since, 3) if self.dirty_since is not None else 0.0,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "conflicts": self.conflicts,
+        }
+
+
+def create_storage(backend: str, db_path: Path, json_path: Path) -> ChatStorage:
+    if backend == "json":
+        return JSONFileStorage(json_path)
+
+    if backend != "sqlite":
+        raise ValueError(f"Unknown chat store backend: {backend}")
+
+    storage = SQLiteStorage(db_path, compact_every=int(os.getenv("CHAT_STORE_COMPACT_EVERY", "500")))
+    if json_path.exists() and storage.is_empty():
+        storage.import_json(json_path)
+    return storage
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in {"import", "export"}:
+        print("Usage: python storage.py import|export <chat_store.db> <chat_store.json>")
+        sys.exit(1)
+
+    command, db_file, json_file = sys.argv[1], Path(sys.argv[2]), Path(sys.argv[3])
+    sqlite_storage = SQLiteStorage(db_file)
+    if command == "import":
+        print(f"Imported {sqlite_storage.import_json(json_file)} chats into {db_file}")
+    else:
+        sqlite_storage.export_json(json_file)
+        print(f"Exported chats to {json_file}")
+    sqlite_storage.close()
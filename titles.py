@@ -0,0 +1,177 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Any
+
+from passages import tokenize
+from tracing import background_trace, current_request_id, span
+
+TitleHistory = list[dict[str, str]]
+
+
+@dataclass(slots=True)
+class TitleState:
+    user_turns: int = 0
+    terms: set[str] = field(default_factory=set)
+
+
+def user_terms(history: TitleHistory) -> set[str]:
+    return {term for item in history if item.get("role") == "user" for term in tokenize(item.get("content", "")) if len(term) > 2}
+
+
+class TitleQueue:
+    def __init__(
+        self,
+        load: Callable[[str, str], TitleHistory | None],
+        generate: Callable[[list[TitleHistory]], Awaitable[list[str]]],
+        apply: Callable[[str, str, str], None],
+        debounce_seconds: float = 4.0,
+        max_batch: int = 8,
+        refresh_turns: int = 2,
+        shift_min_turns: int = 2,
+        shift_overlap: float = 0.2,
+    ):
+        self.load = load
+        self.generate = generate
+        self.apply = apply
+        self.debounce_seconds = debounce_seconds
+        self.max_batch = max_batch
+        self.refresh_turns = refresh_turns
+        self.shift_min_turns = shift_min_turns
+        self.shift_overlap = shift_overlap
+        self.states: dict[tuple[str, str], TitleState] = {}
+        self.pending: dict[tuple[str, str], float] = {}
+        self.request_ids: dict[tuple[str, str], str] = {}
+        self.in_flight = 0
+        self.batches = 0
+        self.generated = 0
+        self.skipped = 0
+        self.failures = 0
+        self.wake = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.wake = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+            if self.pending:
+                self.wake.set()
+
+    def needs_refresh(self, key: tuple[str, str], history: TitleHistory) -> bool:
+        user_turns = sum(1 for item in history if item.get("role") == "user")
+        state = self.states.get(key)
+        if user_turns <= self.refresh_turns:
+            return True
+        if state is None:
+            self.states[key] = TitleState(user_turns, user_terms(history))
+            return False
+        if user_turns - state.user_turns < self.shift_min_turns:
+            return False
+
+        recent = user_terms([item for item in history if item.get("role") == "user"][-self.shift_min_turns :])
+        if not recent:
+            return False
+        return len(recent & state.terms) / len(recent) < self.shift_overlap
+
+    def schedule(self, user_id: str, chat_id: str, history: TitleHistory) -> None:
+        key = (user_id, chat_id)
+        if not self.needs_refresh(key, history):
+            self.skipped += 1
+            return
+
+        self.pending[key] = monotonic() + self.debounce_seconds
+        request_id = current_request_id()
+        if request_id:
+            self.request_ids[key] = request_id
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.start()
+        self.wake.set()
+
+    def forget(self, user_id: str, chat_ids: list[str]) -> None:
+        for chat_id in chat_ids:
+            self.states.pop((user_id, chat_id), None)
+            self.pending.pop((user_id, chat_id), None)
+            self.request_ids.pop((user_id, chat_id), None)
+
+    async def run(self) -> None:
+        while True:
+            if not self.pending:
+                await self.wake.wait()
+            self.wake.clear()
+            delay = min(self.pending.values(), default=monotonic()) - monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout=delay)
+                    continue
+                except TimeoutError:
+                    pass
+            try:
+                with background_trace("titles.flush"):
+                    await self.flush()
+            except Exception as exc:
+                print(f"Chat title refresh failed: {exc}")
+                self.failures += 1
+
+    def take_due(self) -> list[tuple[str, str]]:
+        now = monotonic()
+        due = sorted((deadline, key) for key, deadline in self.pending.items() if deadline <= now)
+        keys = [key for _, key in due[: self.max_batch]]
+        for key in keys:
+            del self.pending[key]
+        return keys
+
+    async def flush(self) -> None:
+        keys = self.take_due()
+        request_ids = [self.request_ids.pop(key) for key in keys if key in self.request_ids]
+        with span("titles.batch", size=len(keys), request_ids=request_ids):
+            await self.generate_titles(keys)
+
+    async def generate_titles(self, keys: list[tuple[str, str]]) -> None:
+        batch: list[tuple[tuple[str, str], TitleHistory]] = []
+        for key in keys:
+            history = self.load(*key)
+            if history:
+                batch.append((key, history))
+        if not batch:
+            return
+
+        self.in_flight += len(batch)
+        try:
+            titles = await self.generate([history for _, history in batch])
+        except Exception as exc:
+            print(f"Chat title refresh failed: {exc}")
+            self.failures += 1
+            titles = []
+        finally:
+            self.in_flight -= len(batch)
+
+        self.batches += 1
+        for index, (key, history) in enumerate(batch):
+            title = titles[index] if index < len(titles) else ""
+            self.states[key] = TitleState(sum(1 for item in history if item.get("role") == "user"), user_terms(history))
+            if title:
+                self.generated += 1
+            self.apply(*key, title)
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": len(self.pending),
+            "in_flight": self.in_flight,
+            "batches": self.batches,
+            "generated": self.generated,
+            "skipped": self.skipped,
+            "failures": self.failures,
+        }
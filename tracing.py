@@ -0,0 +1,230 @@
+import cProfile
+import heapq
+import json
+import os
+import random
+import uuid
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+from time import perf_counter
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "").strip()
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+PROFILE_SLOWEST = int(os.getenv("PROFILE_SLOWEST", "0"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.1"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    span_id: str
+    parent_id: str | None
+    start: float
+    end: float | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+
+@dataclass(slots=True)
+class Trace:
+    request_id: str
+    name: str
+    started_at: str
+    start: float
+    attributes: dict[str, Any] = field(default_factory=dict)
+    spans: list[Span] = field(default_factory=list)
+    profile: cProfile.Profile | None = None
+    sampled: bool = True
+    finished: bool = False
+
+    def to_dict(self, duration: float) -> dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(duration * 1000, 3),
+            "attributes": self.attributes,
+            "spans": [
+                {
+                    "name": span.name,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "start_ms": round((span.start - self.start) * 1000, 3),
+                    "duration_ms": round(((span.end or span.start) - span.start) * 1000, 3),
+                    "attributes": span.attributes,
+                    "error": span.error,
+                }
+                for span in self.spans
+            ],
+        }
+
+
+current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+current_request: ContextVar[str | None] = ContextVar("current_request", default=None)
+response_traces: ContextVar[list[Trace] | None] = ContextVar("response_traces", default=None)
+
+
+class SlowestProfiles:
+    def __init__(self, keep: int, directory: Path):
+        self.keep = keep
+        self.directory = directory
+        self.active = False
+        self.saved: list[tuple[float, str]] = []
+
+    def start(self) -> cProfile.Profile | None:
+        if self.keep <= 0 or self.active or random.random() >= PROFILE_SAMPLE_RATE:
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        self.active = True
+        return profile
+
+    def finish(self, profile: cProfile.Profile, request_id: str, duration: float) -> None:
+        profile.disable()
+        self.active = False
+        if len(self.saved) >= self.keep and duration <= self.saved[0][0]:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{duration * 1000:09.1f}ms-{request_id}.prof"
+        profile.dump_stats(path)
+        heapq.heappush(self.saved, (duration, str(path)))
+        if len(self.saved) > self.keep:
+            _, evicted = heapq.heappop(self.saved)
+            Path(evicted).unlink(missing_ok=True)
+
+
+profiles = SlowestProfiles(PROFILE_SLOWEST, PROFILE_DIR)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_request_id() -> str | None:
+    return current_request.get()
+
+
+def start_trace(name: str, request_id: str | None = None, profile: bool = True, **attributes: Any) -> Trace:
+    request_id = request_id or new_request_id()
+    current_request.set(request_id)
+    trace = Trace(request_id, name, datetime.now(timezone.utc).isoformat(), perf_counter(), attributes)
+    trace.sampled = bool(TRACE_EXPORT_PATH) and random.random() < TRACE_SAMPLE_RATE
+    activate_trace(trace)
+    if profile:
+        trace.profile = profiles.start()
+    return trace
+
+
+def finish_after_response(trace: Trace) -> bool:
+    traces = response_traces.get()
+    if traces is None:
+        return False
+    traces.append(trace)
+    return True
+
+
+def activate_trace(trace: Trace) -> None:
+    current_request.set(trace.request_id)
+    current_trace.set(trace if trace.sampled and not trace.finished else None)
+    current_span.set(None)
+
+
+def finish_trace(trace: Trace | None) -> None:
+    if trace is None or trace.finished:
+        return
+
+    trace.finished = True
+    duration = perf_counter() - trace.start
+    if trace.profile is not None:
+        profiles.finish(trace.profile, trace.request_id, duration)
+        trace.profile = None
+    if not trace.sampled:
+        return
+
+    try:
+        with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as file:
+            file.write(json.dumps(trace.to_dict(duration), ensure_ascii=False, default=str) + "\n")
+    except OSError as exc:
+        print(f"Trace export failed: {exc}")
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | None]:
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = current_span.get()
+    item = Span(name, uuid.uuid4().hex[:8], parent.span_id if parent else None, perf_counter(), attributes=attributes)
+    trace.spans.append(item)
+    token = current_span.set(item)
+    try:
+        yield item
+    except BaseException as exc:
+        item.error = type(exc).__name__
+        raise
+    finally:
+        item.end = perf_counter()
+        current_span.reset(token)
+
+
+def annotate(**attributes: Any) -> None:
+    item = current_span.get()
+    if item is not None:
+        item.attributes.update(attributes)
+
+
+@contextmanager
+def background_trace(name: str, **attributes: Any) -> Iterator[Trace]:
+    tokens = (current_trace.set(None), current_span.set(None), current_request.set(None))
+    trace = start_trace(name, profile=False, **attributes)
+    try:
+        yield trace
+    finally:
+        finish_trace(trace)
+        current_trace.reset(tokens[0])
+        current_span.reset(tokens[1])
+        current_request.reset(tokens[2])
+
+
+def traced(name: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    def decorate(function: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @wraps(function)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            with span(name):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+class TracingMiddleware:
+    def __init__(self, app: Callable[..., Awaitable[None]]):
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable[[], Awaitable[dict[str, Any]]], send: Callable[[dict[str, Any]], Awaitable[None]]) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traces: list[Trace] = []
+        token = response_traces.set(traces)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            response_traces.reset(token)
+            for trace in traces:
+                finish_trace(trace)
@@ -1,19 +1,133 @@
 import os
 import re
+import time
 import asyncio
-import ssl
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email.utils import parsedate_to_datetime
 from typing import List, Dict, Any, Optional, Tuple
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlsplit, urlunsplit
 
 import aiohttp
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, FeatureNotFound
 from ddgs import DDGS
 
+from http_pool import INSECURE_SSL_CONTEXT, SSL_CONTEXT, get_session
+from metrics import observe_stage
+from tracing import annotate, traced
+
 async def extract_urls_from_text(text: str) -> List[str]:
-    url_pattern = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+[/\w\.-]*(?:\?[=&\w\.\-]*)*'
+    url_pattern = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+(?::\d+)?[/\w\.-]*(?:\?[=&\w\.\-]*)*'
     return re.findall(url_pattern, text)
 
-async def fetch_url_content(url: str, timeout: int = 30, verify_ssl: bool = False) -> Tuple[Optional[str], Optional[str]]:
+class PageCache:
+    def __init__(self, max_entries: int = 256, default_ttl: float = 300, max_ttl: float = 3600):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.entries: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.stale_hits = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return entry['expires_at'] > time.monotonic()
+
+    def ttl_for(self, headers: Dict[str, str]) -> Optional[float]:
+        directives = {}
+        for part in headers.get('cache-control', '').lower().split(','):
+            name, _, value = part.strip().partition('=')
+            if name:
+                directives[name] = value.strip('"')
+
+        if 'no-store' in directives:
+            return None
+        if 'no-cache' in directives:
+            return 0.0
+        if 'max-age' in directives:
+            try:
+                return min(max(float(directives['max-age']), 0.0), self.max_ttl)
+            except ValueError:
+                return 0.0
+        if 'expires' in headers:
+            try:
+                expires_at = parsedate_to_datetime(headers['expires']).timestamp()
+            except (TypeError, ValueError):
+                return 0.0
+            return min(max(expires_at - time.time(), 0.0), self.max_ttl)
+        return self.default_ttl
+
+    def put(self, key: str, text: str, headers: Dict[str, str]) -> None:
+        ttl = self.ttl_for(headers)
+        if ttl is None:
+            self.entries.pop(key, None)
+            return
+
+        self.entries[key] = {
+            'text': text,
+            'expires_at': time.monotonic() + ttl,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+        }
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def refresh(self, key: str, entry: Dict[str, Any], headers: Dict[str, str]) -> None:
+        ttl = self.ttl_for(headers)
+        if ttl is None:
+            self.entries.pop(key, None)
+            return
+        entry['expires_at'] = time.monotonic() + ttl
+        entry['etag'] = headers.get('etag') or entry['etag']
+        entry['last_modified'] = headers.get('last-modified') or entry['last_modified']
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'stale_hits': self.stale_hits,
+        }
+
+page_cache = PageCache(
+    max_entries=int(os.getenv('PAGE_CACHE_MAX_ENTRIES', '256')),
+    default_ttl=float(os.getenv('PAGE_CACHE_DEFAULT_TTL_SECONDS', '300')),
+    max_ttl=float(os.getenv('PAGE_CACHE_MAX_TTL_SECONDS', '3600')),
+)
+
+URL_ANALYSIS_DEADLINE_SECONDS = float(os.getenv('URL_ANALYSIS_DEADLINE_SECONDS', '8'))
+MAX_PAGE_BYTES = int(os.getenv('MAX_PAGE_BYTES', str(2 * 1024 * 1024)))
+MAX_EXTRACTED_CHARS = int(os.getenv('MAX_EXTRACTED_CHARS', '60000'))
+HTML_PARSER = os.getenv('HTML_PARSER', 'html.parser').strip() or 'html.parser'
+HTML_PARSE_PROCESSES = int(os.getenv('HTML_PARSE_PROCESSES', '2'))
+
+parse_pool: Optional[ProcessPoolExecutor] = None
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    port = parts.port
+    if port and not ((scheme == 'http' and port == 80) or (scheme == 'https' and port == 443)):
+        host = f"{host}:{port}"
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+@observe_stage('url_fetch')
+@traced('url.fetch')
+async def fetch_page(url: str, timeout: int = 30, verify_ssl: bool = False, extra_headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    annotate(url=url, verify_ssl=verify_ssl, conditional=bool(extra_headers))
     try:
         timeout_ctx = aiohttp.ClientTimeout(total=timeout)
         
@@ -27,48 +141,60 @@ async def fetch_url_content(url: str, timeout: int = 30, verify_ssl: bool = Fals
             'Upgrade-Insecure-Requests': '1',
             'Cache-Control': 'max-age=0',
         }
+        if extra_headers:
+            headers.update(extra_headers)
         
-        if not verify_ssl:
-            ssl_context = ssl.create_default_context()
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-            conn = aiohttp.TCPConnector(ssl=ssl_context)
-            async with aiohttp.ClientSession(timeout=timeout_ctx, connector=conn) as session:
-                async with session.get(url, headers=headers, allow_redirects=True) as response:
-                    if response.status == 200:
-                        content_type = response.headers.get('Content-Type', '').lower()
-                        
-                        if 'text/html' in content_type:
-                            html_content = await response.text()
-                            return html_content, None
-                        else:
-                            return None, f"URL doesn't contain HTML content (Content-Type: {content_type})"
-                    else:
-                        return None, f"Failed to fetch URL: HTTP {response.status}"
-        else:
-            async with aiohttp.ClientSession(timeout=timeout_ctx) as session:
-                async with session.get(url, headers=headers, allow_redirects=True) as response:
-                    if response.status == 200:
-                        content_type = response.headers.get('Content-Type', '').lower()
-                        
-                        if 'text/html' in content_type:
-                            html_content = await response.text()
-                            return html_content, None
-                        else:
-                            return None, f"URL doesn't contain HTML content (Content-Type: {content_type})"
-                    else:
-                        return None, f"Failed to fetch URL: HTTP {response.status}"
+        ssl_context = SSL_CONTEXT if verify_ssl else INSECURE_SSL_CONTEXT
+        session = get_session("web")
+        async with session.get(url, headers=headers, allow_redirects=True, ssl=ssl_context, timeout=timeout_ctx) as response:
+            response_headers = {name.lower(): value for name, value in response.headers.items()}
+            annotate(status=response.status)
+            if response.status == 304:
+                return {'status': 304, 'html': None, 'error': None, 'headers': response_headers}
+            if response.status == 200:
+                content_type = response.headers.get('Content-Type', '').lower()
+                
+                if 'text/html' in content_type:
+                    html_content = await read_capped_body(response, MAX_PAGE_BYTES)
+                    return {'status': 200, 'html': html_content, 'error': None, 'headers': response_headers}
+                else:
+                    return {'status': 200, 'html': None, 'error': f"URL doesn't contain HTML content (Content-Type: {content_type})", 'headers': response_headers}
+            else:
+                return {'status': response.status, 'html': None, 'error': f"Failed to fetch URL: HTTP {response.status}", 'headers': response_headers}
     
     except aiohttp.ClientError as e:
-        return None, f"Client error: {str(e)}"
+        return {'status': 0, 'html': None, 'error': f"Client error: {str(e)}", 'headers': {}}
     except asyncio.TimeoutError:
-        return None, f"Request timed out after {timeout} seconds"
+        return {'status': 0, 'html': None, 'error': f"Request timed out after {timeout} seconds", 'headers': {}}
     except Exception as e:
-        return None, f"Error fetching URL: {str(e)}"
+        return {'status': 0, 'html': None, 'error': f"Error fetching URL: {str(e)}", 'headers': {}}
 
-async def extract_text_from_html(html_content: str, url: str) -> str:
+async def fetch_url_content(url: str, timeout: int = 30, verify_ssl: bool = False) -> Tuple[Optional[str], Optional[str]]:
+    result = await fetch_page(url, timeout=timeout, verify_ssl=verify_ssl)
+    return result['html'], result['error']
+
+async def read_capped_body(response: aiohttp.ClientResponse, max_bytes: int) -> str:
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(65536):
+        body.extend(chunk)
+        if len(body) >= max_bytes:
+            del body[max_bytes:]
+            break
+    return body.decode(response.charset or 'utf-8', errors='replace')
+
+def iter_text_lines(node: Any):
+    for text in node.stripped_strings:
+        for line in text.splitlines():
+            line = line.strip()
+            if line:
+                yield line
+
+def extract_text_sync(html_content: str, url: str, parser: str = 'html.parser', max_length: int = 15000) -> str:
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
+        try:
+            soup = BeautifulSoup(html_content, parser)
+        except FeatureNotFound:
+            soup = BeautifulSoup(html_content, 'html.parser')
         
         for script_or_style in soup(['script', 'style', 'header', 'footer', 'nav']):
             script_or_style.decompose()
@@ -76,12 +202,9 @@ async def extract_text_from_html(html_content: str, url: str) -> str:
         content_areas = soup.select('article, main, #content, .content, [role="main"]')
         
         if content_areas:
-            content = content_areas[0].get_text(separator='\n', strip=True)
+            content_node = content_areas[0]
         else:
-            content = soup.body.get_text(separator='\n', strip=True) if soup.body else soup.get_text(separator='\n', strip=True)
-        
-        lines = (line.strip() for line in content.splitlines())
-        content = '\n'.join(line for line in lines if line)
+            content_node = soup.body if soup.body else soup
         
         title = soup.title.string if soup.title else "No title found"
         
@@ -95,10 +218,21 @@ async def extract_text_from_html(html_content: str, url: str) -> str:
         if meta_desc:
             summary += f"Description: {meta_desc}\n"
         
-        full_text = f"{summary}\n\nCONTENT:\n{content}"
+        header = f"{summary}\n\nCONTENT:\n"
+        budget = max(max_length - len(header), 0)
+        lines = []
+        used = 0
+        truncated = False
+        for line in iter_text_lines(content_node):
+            if used + len(line) > budget:
+                lines.append(line[:budget - used])
+                truncated = True
+                break
+            lines.append(line)
+            used += len(line) + 1
         
-        max_length = 15000
-        if len(full_text) > max_length:
+        full_text = header + '\n'.join(lines)
+        if truncated:
             full_text = full_text[:max_length] + "...\n[Content truncated due to length]"
         
         return full_text
@@ -106,30 +240,111 @@ async def extract_text_from_html(html_content: str, url: str) -> str:
     except Exception as e:
         return f"Error extracting text from {url}: {str(e)}"
 
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    global parse_pool
+    if HTML_PARSE_PROCESSES <= 0:
+        return None
+    if parse_pool is None:
+        parse_pool = ProcessPoolExecutor(max_workers=HTML_PARSE_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+    return parse_pool
+
+def shutdown_parse_pool() -> None:
+    global parse_pool
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=False, cancel_futures=True)
+        parse_pool = None
+
+@observe_stage('html_extract')
+@traced('html.extract')
+async def extract_text_from_html(html_content: str, url: str) -> str:
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
+    if pool is not None:
+        try:
+            return await loop.run_in_executor(pool, extract_text_sync, html_content, url, HTML_PARSER, MAX_EXTRACTED_CHARS)
+        except BrokenProcessPool:
+            shutdown_parse_pool()
+    return await asyncio.to_thread(extract_text_sync, html_content, url, HTML_PARSER, MAX_EXTRACTED_CHARS)
+
+@traced('url.analyze')
 async def analyze_url(url: str) -> Tuple[str, Optional[str]]:
-    html_content, error = await fetch_url_content(url, verify_ssl=True)
+    key = normalize_url(url)
+    entry = page_cache.get(key)
+    annotate(url=key)
     
-    if error and "SSL" in error:
-        html_content, error = await fetch_url_content(url, verify_ssl=False)
+    if entry and page_cache.is_fresh(entry):
+        page_cache.hits += 1
+        annotate(cache='hit')
+        return entry['text'], None
     
-    if error:
-        return "", error
+    conditional_headers = {}
+    if entry and entry['etag']:
+        conditional_headers['If-None-Match'] = entry['etag']
+    if entry and entry['last_modified']:
+        conditional_headers['If-Modified-Since'] = entry['last_modified']
+    if conditional_headers:
+        conditional_headers['Cache-Control'] = 'no-cache'
     
-    if html_content:
-        text_content = await extract_text_from_html(html_content, url)
+    result = await fetch_page(url, verify_ssl=True, extra_headers=conditional_headers)
+    
+    if result['error'] and "SSL" in result['error']:
+        annotate(ssl_fallback=True)
+        result = await fetch_page(url, verify_ssl=False, extra_headers=conditional_headers)
+    
+    if result['status'] == 304 and entry:
+        page_cache.revalidations += 1
+        annotate(cache='revalidated')
+        page_cache.refresh(key, entry, result['headers'])
+        return entry['text'], None
+    
+    page_cache.misses += 1
+    annotate(cache='miss')
+    if result['error']:
+        if entry:
+            page_cache.stale_hits += 1
+            annotate(cache='stale')
+            return entry['text'], None
+        return "", result['error']
+    
+    if result['html']:
+        text_content = await extract_text_from_html(result['html'], url)
+        page_cache.put(key, text_content, result['headers'])
         return text_content, None
     
     return "", "No content extracted from URL"
 
-async def analyze_urls_in_text(text: str) -> Dict[str, Any]:
+async def analyze_urls_in_text(text: str, deadline: Optional[float] = None) -> Dict[str, Any]:
     urls = await extract_urls_from_text(text)
     
     if not urls:
         return {"found": False, "message": "No URLs found in the text"}
     
+    if deadline is None:
+        deadline = URL_ANALYSIS_DEADLINE_SECONDS
+    
+    selected = list(dict.fromkeys(urls))[:3]
+    tasks = {url: asyncio.create_task(analyze_url(url)) for url in selected}
+    done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    
+    for task in pending:
+        task.cancel()
+    
     results = []
-    for url in urls[:3]:
-        content, error = await analyze_url(url)
+    for url, task in tasks.items():
+        if task not in done:
+            results.append({
+                "url": url,
+                "success": False,
+                "error": f"Timed out after {deadline:g} seconds",
+                "content": "",
+                "timed_out": True
+            })
+            continue
+        
+        try:
+            content, error = task.result()
+        except Exception as e:
+            content, error = "", f"Error analyzing URL: {str(e)}"
         
         if error:
             results.append({
@@ -150,13 +365,113 @@ async def analyze_urls_in_text(text: str) -> Dict[str, Any]:
         "found": True,
         "count": len(urls),
         "analyzed": len(results),
+        "timed_out": len(pending),
         "results": results
     }
 
+class SearchPool:
+    def __init__(self, workers: int = 4, max_queue: int = 32, cache_ttl: float = 600, cache_size: int = 512):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.cache: OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, Any]]]] = OrderedDict()
+        self.in_flight: Dict[Tuple[str, int], asyncio.Future] = {}
+        self.queued = 0
+        self.active = 0
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def client(self) -> DDGS:
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = DDGS()
+            self.local.client = client
+        return client
+
+    def run_search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return list(self.client().text(query, max_results=max_results))
+        except Exception:
+            self.local.client = None
+            raise
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    async def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        key = (re.sub(r'\s+', ' ', query.lower()).strip(), max_results)
+        cached = self.cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+        if key in self.in_flight:
+            self.hits += 1
+            return await asyncio.shield(self.in_flight[key])
+
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise RuntimeError("Search queue is full")
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ddgs')
+
+        self.misses += 1
+        with self.lock:
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self.run_search, query, max_results)
+        self.in_flight[key] = future
+        future.add_done_callback(lambda done: self.store(key, done))
+        return await asyncio.shield(future)
+
+    def store(self, key: Tuple[str, int], future: asyncio.Future) -> None:
+        self.in_flight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        self.cache[key] = (time.monotonic() + self.cache_ttl, future.result())
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.workers,
+            'queued': self.queued,
+            'active': self.active,
+            'cached': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'rejected': self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+search_pool = SearchPool(
+    workers=int(os.getenv('SEARCH_WORKERS', '4')),
+    max_queue=int(os.getenv('SEARCH_MAX_QUEUE', '32')),
+    cache_ttl=float(os.getenv('SEARCH_CACHE_TTL_SECONDS', '600')),
+    cache_size=int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '512')),
+)
+
+@observe_stage('search')
+@traced('search')
 async def search_web(query: str, max_results: int = 5) -> Dict[str, Any]:
     try:
-        loop = asyncio.get_running_loop()
-        results = await loop.run_in_executor(None, lambda: list(DDGS().text(query, max_results=max_results)))
+        results = await search_pool.search(query, max_results)
     except Exception as e:
         return {
             "success": False,